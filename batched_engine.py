@@ -0,0 +1,603 @@
+"""
+Lockstep batched engine for the emergency department simulation.
+
+BatchedEDSimulation advances many independent replications of the model together. The
+state of every replication (clock, free beds per zone, busy servers, ambulances, queues and
+statistics) is kept in NumPy arrays with one row per replication, and every step processes
+the next event of all the replications at once: each replication's next event is found by
+an argmin over its row of the event table, and the handlers are applied with vectorized
+operations to the rows whose next event is of their type.
+
+The model is the same as EDSimulation's, event for event (including its queue disciplines
+and the quirks of its statistics), so the results are statistically equivalent to those of
+the scalar engine, though not identical: the random draws are made in a different order.
+
+   results = run_batched_replications(1000, 24 * 60 * 30, seed=0)
+
+Patients are packed into ints (triage type, chief complaint, zone and arrival type) so that
+queues and the event table are plain integer arrays.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import hospital_sim
+
+# Event kinds, as in EDSimulation, plus the arrival of an ambulance that was diverted
+WALK_IN_ARRIVAL = 0
+AMBULANCE_ARRIVAL = 1
+DIVERTED_AMBULANCE_ARRIVAL = 2
+AMBULANCE_DISPATCH = 3
+TRIAGE_DEPARTURE = 4
+WORKUP_DEPARTURE = 5
+SPECIALIST_DEPARTURE = 6
+
+NUMBER_OF_AMBULANCES = 10
+
+def pack_patient(triage_type, complaint, zone, arrival_type):
+   return triage_type | (complaint << 3) | (zone << 5) | (arrival_type << 8)
+
+def triage_types(patients):
+   return patients & 7
+
+def complaints(patients):
+   return (patients >> 3) & 3
+
+def zones(patients):
+   return (patients >> 5) & 7
+
+def with_zone(patients, zone):
+   return (patients & ~(7 << 5)) | (zone << 5)
+
+class BatchedQueue():
+    """
+      One queue per replication, stored as the rows of a 2D array of packed patients. The
+      queues are first in, first out, or last in, first out with lifo (as the bed queues of
+      EDSimulation, which pop from the right). Rows grow as needed.
+    """
+    def __init__(self, number_of_replications, lifo=False, capacity=16):
+        self.lifo = lifo
+        self.data = np.zeros((number_of_replications, capacity), dtype=np.int32)
+        self.head = np.zeros(number_of_replications, dtype=np.int64)
+        self.tail = np.zeros(number_of_replications, dtype=np.int64)
+
+    def lengths(self, rows=slice(None)):
+        return self.tail[rows] - self.head[rows]
+
+    def push(self, rows, patients):
+        if not len(rows):
+            return
+        if (self.tail[rows] == self.data.shape[1]).any():
+            self._make_room()
+        self.data[rows, self.tail[rows]] = patients
+        self.tail[rows] += 1
+
+    def pop(self, rows):
+        """
+        Removes and returns the next patient of the queue of every given replication (the
+        queues must not be empty).
+        """
+        if self.lifo:
+            self.tail[rows] -= 1
+            patients = self.data[rows, self.tail[rows]]
+        else:
+            patients = self.data[rows, self.head[rows]]
+            self.head[rows] += 1
+        emptied = rows[self.head[rows] == self.tail[rows]]
+        self.head[emptied] = 0
+        self.tail[emptied] = 0
+        return patients
+
+    def _make_room(self):
+        # Move every queue to the start of its row, then double the rows if one is still full
+        capacity = self.data.shape[1]
+        lengths = self.lengths()
+        positions = np.minimum(self.head[:, None] + np.arange(capacity), capacity - 1)
+        self.data = np.take_along_axis(self.data, positions, axis=1)
+        self.head[:] = 0
+        self.tail[:] = lengths
+        if (lengths == capacity).any():
+            self.data = np.concatenate((self.data, np.zeros_like(self.data)), axis=1)
+
+class BatchedArrivals():
+    """
+      Non-homogeneous Poisson arrival streams of every replication, generated by inversion
+      of the cumulative rate function as in ArrivalSchedule, one arrival per replication
+      at a time.
+    """
+    def __init__(self, hourly_rates, number_of_replications):
+        rates = np.asarray(hourly_rates, dtype=float)
+        period_length = (24 * 60) / len(rates)
+        self._breakpoints = np.arange(len(rates) + 1) * period_length
+        self._cumulative_rates = np.concatenate(([0], np.cumsum(rates / 60 * period_length)))
+        self._daily_rate = self._cumulative_rates[-1]
+        self._positions = np.zeros(number_of_replications)
+
+    def next_arrivals(self, rows, generator):
+        self._positions[rows] -= np.log1p(-generator.random(len(rows)))
+        day, remainder = np.divmod(self._positions[rows], self._daily_rate)
+        return day * 24 * 60 + np.interp(remainder, self._cumulative_rates, self._breakpoints)
+
+def uniform(generator, low, high, size):
+   return low + (high - low) * generator.random(size)
+
+def triangular(generator, left, mode, right, size):
+   u = generator.random(size)
+   c = (mode - left) / (right - left)
+   return np.where(u < c,
+                   left + np.sqrt(u * (right - left) * (mode - left)),
+                   right - np.sqrt((1 - u) * (right - left) * (right - mode)))
+
+# Bounds of the uniform workup service time per [triage type, chief complaint], see
+# generate_workup_service_time (constant times have equal bounds)
+WORKUP_TIME_LOW = np.array([[0, 0, 0], [0, 5, 2], [0, 5, 2], [0, 5, 5], [0, 2, 2], [0, 5, 5]], dtype=float)
+WORKUP_TIME_HIGH = np.array([[0, 0, 0], [0, 12, 5], [0, 15, 2], [0, 10, 10], [0, 2, 2], [0, 10, 10]], dtype=float)
+
+def procedure_table(procedure_mix):
+   """
+   Turns a procedure mix (see PROCEDURE_MIX) into arrays indexed by [triage type, chief
+   complaint, procedure of the mix]: the probability of the procedure, the left, mode and
+   right parameters of its duration (uniforms have their mode on the left) and whether the
+   duration is triangular. Missing procedures have a probability of 0.
+   """
+   length = max(len(procedures) for procedures in procedure_mix.values())
+   probability = np.zeros((6, 3, length))
+   left, mode, right = np.zeros((6, 3, length)), np.zeros((6, 3, length)), np.ones((6, 3, length))
+   is_triangular = np.zeros((6, 3, length), dtype=bool)
+   for (triage_type, complaint), procedures in procedure_mix.items():
+      for i, (procedure_probability, procedure) in enumerate(procedures):
+         _, distribution, parameters = hospital_sim.PROCEDURES[procedure]
+         index = (triage_type, complaint, i)
+         probability[index] = procedure_probability
+         if distribution == "triangular":
+            left[index], mode[index], right[index] = parameters
+            is_triangular[index] = True
+         else:
+            left[index], right[index] = parameters
+            mode[index] = left[index]
+   return probability, left, mode, right, is_triangular
+
+class BatchedEDSimulation():
+    """
+      Object used to represent number_of_replications independent runs of the emergency
+      department simulation, advanced in lockstep. Takes the same configuration as
+      EDSimulation (every replication shares it); the seed (an int or a SeedSequence) seeds
+      the single random number generator of the batch.
+
+      Each replication has an event table with a fixed set of slots: one for the next
+      walk-in arrival, one for the next ambulance dispatch, one per ambulance, and one per
+      nurse, doctor and specialist for the departures of the patients they serve. Free
+      slots hold an infinite time.
+    """
+    def __init__(self, number_of_replications, seed=None, procedure_mix=hospital_sim.PROCEDURE_MIX,
+                 arrival_rates=hospital_sim.ARRIVAL_RATES, max_num_servers=hospital_sim.MAX_NUM_SERVERS,
+                 number_of_beds_per_zone=hospital_sim.NUMBER_OF_BEDS_PER_ZONE, warmup_time=hospital_sim.WARMUP_TIME):
+        n = number_of_replications
+        self.number_of_replications = n
+        self.generator = np.random.default_rng(seed)
+        self.procedure_mix = procedure_mix
+        self.procedure_table = procedure_table(procedure_mix)
+        self.max_num_servers = dict(max_num_servers)
+        self.warmup_time = warmup_time
+        self.walk_in_arrivals = BatchedArrivals(arrival_rates[1], n)
+        self.ambulance_dispatches = BatchedArrivals(arrival_rates[0], n)
+
+        self.clock = np.zeros(n)
+        self.prev_event_time = np.zeros(n)
+
+        # Event table slots (start, end) of each kind of event
+        nurses, doctors, specialists = (self.max_num_servers[server] for server in ("nurses", "doctors", "specialists"))
+        self.ambulance_slots = (2, 2 + NUMBER_OF_AMBULANCES)
+        self.triage_slots = (self.ambulance_slots[1], self.ambulance_slots[1] + nurses)
+        self.workup_slots = (self.triage_slots[1], self.triage_slots[1] + doctors)
+        self.specialist_slots = (self.workup_slots[1], self.workup_slots[1] + specialists)
+        number_of_slots = self.specialist_slots[1]
+        self.event_times = np.full((n, number_of_slots), np.inf)
+        self.event_kinds = np.zeros((n, number_of_slots), dtype=np.int8)
+        self.event_patients = np.zeros((n, number_of_slots), dtype=np.int32)
+
+        # The FEL starts off with an ambulance dispatch and a walk-in arrival at t = 0,
+        # the dispatch first as in EDSimulation
+        self.event_times[:, 0] = 0
+        self.event_kinds[:, 0] = AMBULANCE_DISPATCH
+        self.event_times[:, 1] = 0
+        self.event_kinds[:, 1] = WALK_IN_ARRIVAL
+        self.event_patients[:, 1] = pack_patient(0, 0, 0, 1)
+        self.dispatch_slot, self.walk_in_slot = 0, 1
+
+        # State Variables - Resource Statuses
+        self.available_ambulances = np.full(n, NUMBER_OF_AMBULANCES - 1)
+        self.diverted_ambulances = np.zeros(n, dtype=np.int64)
+        self.number_of_beds_per_zone = np.zeros((n, 5), dtype=np.int64)
+        for zone, beds in number_of_beds_per_zone.items():
+            self.number_of_beds_per_zone[:, zone] = beds
+        self.status_workup_doctors = np.zeros(n, dtype=np.int64)
+        self.status_triage_nurses = np.zeros(n, dtype=np.int64)
+        self.status_specialists = np.zeros(n, dtype=np.int64)
+
+        # State Variables - Queues (walk-ins waiting for triage have no attributes yet)
+        self.triage_queue_lengths = np.zeros(n, dtype=np.int64)
+        self.bed_queues = {key: BatchedQueue(n, lifo=True) for key in ("1", "2", "3,4,5")}
+        self.workup_queues = {key: BatchedQueue(n) for key in ("1", "2", "3,4,5")}
+        self.interrupt_queues = {key: BatchedQueue(n) for key in ("2", "3,4,5")}
+        self.specialist_queue = BatchedQueue(n)
+
+        ######## Statistics to collect and update ########
+        self.total_interrupts = np.zeros(n, dtype=np.int64)
+        self.total_patients = {"in": np.zeros(n, dtype=np.int64), "out": np.zeros(n, dtype=np.int64)}
+        self.max_queue_lengths = {queue: np.zeros(n, dtype=np.int64) for queue in ("Triage", "Bed", "Workup", "Specialist")}
+        self.queue_areas = {queue: np.zeros(n) for queue in ("Triage", "Bed", "Workup", "Specialist")}
+        self.server_uptime = {server: np.zeros(n) for server in ("Triage", "Workup", "Specialist")}
+        self.diversion_area = np.zeros(n)
+        ##################################################
+
+    def bed_queue_lengths(self, rows=slice(None)):
+        return sum(queue.lengths(rows) for queue in self.bed_queues.values())
+
+    def workup_queue_lengths(self, rows=slice(None)):
+        return sum(queue.lengths(rows) for queue in self.workup_queues.values())
+
+    ####################################### RANDOM VARIATES #######################################
+
+    def triage_times(self, patients):
+        is_type_3 = triage_types(patients) == 3
+        return np.where(is_type_3, uniform(self.generator, 0.75, 2.25, len(patients)),
+                        uniform(self.generator, 7.5, 11.25, len(patients)))
+
+    def workup_service_times(self, patients):
+        types, patient_complaints = triage_types(patients), complaints(patients)
+        low, high = WORKUP_TIME_LOW[types, patient_complaints], WORKUP_TIME_HIGH[types, patient_complaints]
+        return low + (high - low) * self.generator.random(len(patients))
+
+    def procedure_times(self, patients):
+        table = self.procedure_table
+        types, patient_complaints = triage_types(patients), complaints(patients)
+        probability, left, mode, right, is_triangular = (column[types, patient_complaints] for column in table)
+        performed = self.generator.random(probability.shape) <= probability
+        u = self.generator.random(probability.shape)
+        durations = np.where(is_triangular,
+                             np.where(u < (mode - left) / (right - left),
+                                      left + np.sqrt(u * (right - left) * (mode - left)),
+                                      right - np.sqrt((1 - u) * (right - left) * (right - mode))),
+                             left + (right - left) * u)
+        return (durations * performed).sum(axis=1)
+
+    def complaints_of(self, types):
+        # Types 1, 2 and 4 have two chief complaints, equally likely
+        two_complaints = (types == 1) | (types == 2) | (types == 4)
+        return np.where(two_complaints & (self.generator.random(len(types)) > 0.5), 2, 1)
+
+    def walk_in_triage_types(self, size):
+        r = self.generator.random(size)
+        return np.where(r <= 0.33333, 3, np.where(r <= 0.66667, 4, 5))
+
+    def ambulance_triage_types(self, size):
+        # Same thresholds as generate_ambulance_arrival_triage_type
+        r = self.generator.random(size)
+        return np.where(r <= 0.2, 1, np.where(r <= 0.55, 2, np.where(r <= 85, 3, 4)))
+
+    ########################################## EVENT TABLE ##########################################
+
+    def schedule(self, rows, slots, times, kind, patients):
+        """
+        Schedules an event for every given replication in the first free slot of the range.
+        """
+        if not len(rows):
+            return
+        start, end = slots
+        slot = start + np.isinf(self.event_times[rows, start:end]).argmax(axis=1)
+        self.event_times[rows, slot] = times
+        self.event_kinds[rows, slot] = kind
+        self.event_patients[rows, slot] = patients
+
+    def schedule_workup_departure(self, rows, patients):
+        if not len(rows):
+            return
+        times = self.clock[rows] + self.workup_service_times(patients)
+        self.schedule(rows, self.workup_slots, times, WORKUP_DEPARTURE, patients)
+
+    def start_triage(self, rows):
+        if not len(rows):
+            return
+        self.status_triage_nurses[rows] += 1
+        types = self.walk_in_triage_types(len(rows))
+        patients = pack_patient(types, self.complaints_of(types), 0, 1)
+        self.schedule(rows, self.triage_slots, self.clock[rows] + self.triage_times(patients), TRIAGE_DEPARTURE, patients)
+
+    ############################################ HANDLERS ############################################
+
+    def assign_type_3_4_5_patients_to_zones(self, rows, patients, zones):
+        if not len(rows):
+            return
+        self.number_of_beds_per_zone[rows, zones] -= 1
+        patients = with_zone(patients, zones)
+        busy = self.status_workup_doctors[rows] == self.max_num_servers["doctors"]
+        self.workup_queues["3,4,5"].push(rows[busy], patients[busy])
+        self.status_workup_doctors[rows[~busy]] += 1
+        self.schedule_workup_departure(rows[~busy], patients[~busy])
+
+    def assign_type_1_2_patients_to_zones(self, rows, patients, zones):
+        if not len(rows):
+            return
+        self.number_of_beds_per_zone[rows, zones] -= 1
+        patients = with_zone(patients, zones)
+        busy = self.status_workup_doctors[rows] == self.max_num_servers["doctors"]
+        self.status_workup_doctors[rows[~busy]] += 1
+        self.schedule_workup_departure(rows[~busy], patients[~busy])
+        self.patients_interrupt(rows[busy], patients[busy])
+
+    def patients_interrupt(self, rows, patients):
+        """
+        Interrupts, for every given replication, the patient in workup of lower triage type
+        than the new patient whose departure is due first (see EDSimulation.patient_interrupt),
+        or queues the new patient if there is none.
+        """
+        if not len(rows):
+            return
+        start, end = self.workup_slots
+        times = self.event_times[rows, start:end]
+        candidates = np.isfinite(times) & (triage_types(self.event_patients[rows, start:end]) < triage_types(patients)[:, None])
+        slot = start + np.where(candidates, times, np.inf).argmin(axis=1)
+        found = candidates.any(axis=1)
+
+        failed = ~found
+        failed_types = triage_types(patients[failed])
+        for triage_type in (1, 2):
+            queued = failed_types == triage_type
+            self.workup_queues[str(triage_type)].push(rows[failed][queued], patients[failed][queued])
+
+        rows, patients, slot = rows[found], patients[found], slot[found]
+        interrupted_patients = self.event_patients[rows, slot]
+        self.event_times[rows, slot] = np.inf
+        is_type_2 = triage_types(interrupted_patients) == 2
+        self.interrupt_queues["2"].push(rows[is_type_2], interrupted_patients[is_type_2])
+        self.interrupt_queues["3,4,5"].push(rows[~is_type_2], interrupted_patients[~is_type_2])
+        self.total_interrupts[rows] += 1
+        self.schedule_workup_departure(rows, patients)
+
+    def place_patients(self, rows, patients, zone_preferences, assign, bed_queue):
+        """
+        Gives every patient a bed in the first zone of zone_preferences with a free bed, or
+        puts them in the bed queue.
+        """
+        if not len(rows):
+            return
+        beds = self.number_of_beds_per_zone
+        zones = np.zeros(len(rows), dtype=np.int64)
+        for zone in reversed(zone_preferences):
+            zones = np.where(beds[rows, zone] > 0, zone, zones)
+        placed = zones > 0
+        assign(rows[placed], patients[placed], zones[placed])
+        bed_queue.push(rows[~placed], patients[~placed])
+
+    def handle_arrival_events(self, rows, kinds, patients):
+        is_walk_in = kinds == WALK_IN_ARRIVAL
+        ambulances = rows[~is_walk_in]
+        self.available_ambulances[ambulances] += 1
+        diverted = rows[kinds == DIVERTED_AMBULANCE_ARRIVAL]
+        self.diverted_ambulances[diverted] -= 1
+
+        # Ambulance patients, their triage type is known
+        is_ambulance = kinds == AMBULANCE_ARRIVAL
+        types = triage_types(patients)
+        for lowest_type, highest_type, zone_preferences, assign, bed_queue in (
+                (3, 4, (3, 4), self.assign_type_3_4_5_patients_to_zones, "3,4,5"),
+                (2, 2, (2, 3, 4), self.assign_type_1_2_patients_to_zones, "2"),
+                (1, 1, (1, 2), self.assign_type_1_2_patients_to_zones, "1")):
+            mask = is_ambulance & (types >= lowest_type) & (types <= highest_type)
+            self.place_patients(rows[mask], patients[mask], zone_preferences, assign, self.bed_queues[bed_queue])
+
+        # Walk-ins go to triage, or wait for a nurse
+        walk_ins = rows[is_walk_in]
+        self.schedule(walk_ins, (self.walk_in_slot, self.walk_in_slot + 1),
+                      self.walk_in_arrivals.next_arrivals(walk_ins, self.generator), WALK_IN_ARRIVAL,
+                      pack_patient(0, 0, 0, 1))
+        busy = self.status_triage_nurses[walk_ins] == self.max_num_servers["nurses"]
+        self.triage_queue_lengths[walk_ins[busy]] += 1
+        self.start_triage(walk_ins[~busy])
+
+        # Patients are only counted after the warmup, as EDSimulation resets its statistics then
+        arrivals = rows[is_ambulance | is_walk_in]
+        self.total_patients["in"][arrivals[self.clock[arrivals] > self.warmup_time]] += 1
+
+    def handle_ambulance_dispatch_events(self, rows, patients):
+        size = len(rows)
+        clock = self.clock[rows]
+        self.schedule(rows, (self.dispatch_slot, self.dispatch_slot + 1),
+                      self.ambulance_dispatches.next_arrivals(rows, self.generator), AMBULANCE_DISPATCH, 0)
+        travel_times = triangular(self.generator, 5, 10, 20, size)
+        process_times = uniform(self.generator, 4, 10, size)
+        types = self.ambulance_triage_types(size)
+        # The dispatched patients get their triage type and complaint on dispatch
+        patients = pack_patient(types, self.complaints_of(types), 0, 0)
+
+        available = self.available_ambulances[rows] > 0
+        self.available_ambulances[rows[available]] -= 1
+        to_hospital = available & ((types <= 2) | ((self.bed_queue_lengths(rows) < 5) & (types >= 3) & (types <= 4)))
+        self.schedule(rows[to_hospital], self.ambulance_slots,
+                      (clock + travel_times * 2 + process_times)[to_hospital], AMBULANCE_ARRIVAL, patients[to_hospital])
+
+        diverted = available & ~to_hospital
+        self.diverted_ambulances[rows[diverted]] += 1
+        diverted_travel_times = triangular(self.generator, 10, 15, 25, size)
+        self.schedule(rows[diverted], self.ambulance_slots,
+                      (clock + travel_times + process_times + diverted_travel_times)[diverted],
+                      DIVERTED_AMBULANCE_ARRIVAL, patients[diverted])
+
+    def handle_triage_departures(self, rows, patients):
+        self.status_triage_nurses[rows] -= 1
+        self.place_patients(rows, patients, (4, 3), self.assign_type_3_4_5_patients_to_zones, self.bed_queues["3,4,5"])
+
+        waiting = rows[self.triage_queue_lengths[rows] > 0]
+        self.triage_queue_lengths[waiting] -= 1
+        self.start_triage(waiting)
+
+    def service_waiting_patients(self, rows, queue):
+        if not len(rows):
+            return
+        patients = queue.pop(rows)
+        self.status_workup_doctors[rows] += 1
+        self.schedule_workup_departure(rows, patients)
+
+    def handle_workup_departures(self, rows, patients):
+        self.status_workup_doctors[rows] -= 1
+
+        # Interrupted patients resume first, then queued patients if a doctor is still idle
+        remaining = rows
+        for key in ("2", "3,4,5"):
+            waiting = self.interrupt_queues[key].lengths(remaining) > 0
+            self.service_waiting_patients(remaining[waiting], self.interrupt_queues[key])
+            remaining = remaining[~waiting]
+
+        remaining = rows[self.status_workup_doctors[rows] < self.max_num_servers["doctors"]]
+        for key in ("1", "2", "3,4,5"):
+            waiting = self.workup_queues[key].lengths(remaining) > 0
+            self.service_waiting_patients(remaining[waiting], self.workup_queues[key])
+            remaining = remaining[~waiting]
+
+        busy = self.status_specialists[rows] == self.max_num_servers["specialists"]
+        self.specialist_queue.push(rows[busy], patients[busy])
+        rows, patients = rows[~busy], patients[~busy]
+        self.status_specialists[rows] += 1
+        self.schedule(rows, self.specialist_slots, self.clock[rows] + self.procedure_times(patients),
+                      SPECIALIST_DEPARTURE, patients)
+
+    def handle_specialist_departures(self, rows, patients):
+        waiting = self.specialist_queue.lengths(rows) > 0
+        self.status_specialists[rows[~waiting]] -= 1
+        # As in EDSimulation, the procedure time is drawn for the departing patient
+        queued_patients = self.specialist_queue.pop(rows[waiting])
+        self.schedule(rows[waiting], self.specialist_slots,
+                      self.clock[rows[waiting]] + self.procedure_times(patients[waiting]),
+                      SPECIALIST_DEPARTURE, queued_patients)
+
+        self.total_patients["out"][rows[self.clock[rows] > self.warmup_time]] += 1
+        freed_zones = zones(patients)
+        self.number_of_beds_per_zone[rows, freed_zones] += 1
+
+        # Give the freed bed to a queued patient the zone can take, see check_bed_queue
+        for lowest_zone, highest_zone, keys in ((3, 4, ("2", "3,4,5")), (2, 2, ("1", "2")), (1, 1, ("1",))):
+            in_zone_set = (freed_zones >= lowest_zone) & (freed_zones <= highest_zone)
+            remaining, remaining_zones = rows[in_zone_set], freed_zones[in_zone_set]
+            for key in keys:
+                waiting = self.bed_queues[key].lengths(remaining) > 0
+                self.give_bed_queued_patients(remaining[waiting], remaining_zones[waiting], key)
+                remaining, remaining_zones = remaining[~waiting], remaining_zones[~waiting]
+
+    def give_bed_queued_patients(self, rows, zones, key):
+        if not len(rows):
+            return
+        patients = with_zone(self.bed_queues[key].pop(rows), zones)
+        self.number_of_beds_per_zone[rows, zones] -= 1
+        busy = self.status_workup_doctors[rows] == self.max_num_servers["doctors"]
+        self.workup_queues[key].push(rows[busy], patients[busy])
+        self.status_workup_doctors[rows[~busy]] += 1
+        self.schedule_workup_departure(rows[~busy], patients[~busy])
+
+    def update_simulation_statistics(self, rows):
+        rows = rows[self.clock[rows] > self.warmup_time]
+        # The interval in which the warmup ends only counts from the warmup time on
+        elapsed = self.clock[rows] - np.maximum(self.prev_event_time[rows], self.warmup_time)
+        triage_queue = self.triage_queue_lengths[rows]
+        bed_queue = self.bed_queue_lengths(rows)
+        workup_queue = self.workup_queue_lengths(rows)
+        specialist_queue = self.specialist_queue.lengths(rows)
+
+        self.queue_areas["Triage"][rows] += elapsed * triage_queue
+        self.queue_areas["Bed"][rows] += elapsed * bed_queue
+        self.queue_areas["Workup"][rows] += elapsed * workup_queue
+        self.queue_areas["Specialist"][rows] += elapsed * specialist_queue
+        self.diversion_area[rows] += elapsed * self.diverted_ambulances[rows]
+
+        # As in EDSimulation, the workup and specialist maxima are taken against the triage maximum
+        max_queue_lengths = self.max_queue_lengths
+        max_queue_lengths["Triage"][rows] = np.maximum(max_queue_lengths["Triage"][rows], triage_queue)
+        max_queue_lengths["Bed"][rows] = np.maximum(max_queue_lengths["Bed"][rows], bed_queue)
+        max_queue_lengths["Workup"][rows] = np.maximum(max_queue_lengths["Triage"][rows], workup_queue)
+        max_queue_lengths["Specialist"][rows] = np.maximum(max_queue_lengths["Triage"][rows], specialist_queue)
+
+        self.server_uptime["Triage"][rows] += elapsed * self.status_triage_nurses[rows]
+        self.server_uptime["Workup"][rows] += elapsed * self.status_workup_doctors[rows]
+        self.server_uptime["Specialist"][rows] += elapsed * self.status_specialists[rows]
+
+    def step(self, rows):
+        """
+        Processes the next event of every given replication.
+        """
+        slots = self.event_times[rows].argmin(axis=1)
+        kinds = self.event_kinds[rows, slots]
+        patients = self.event_patients[rows, slots]
+        self.prev_event_time[rows] = self.clock[rows]
+        self.clock[rows] = self.event_times[rows, slots]
+        self.event_times[rows, slots] = np.inf
+
+        is_arrival = kinds <= DIVERTED_AMBULANCE_ARRIVAL
+        if is_arrival.any():
+            self.handle_arrival_events(rows[is_arrival], kinds[is_arrival], patients[is_arrival])
+        for kind, handler in ((AMBULANCE_DISPATCH, self.handle_ambulance_dispatch_events),
+                              (TRIAGE_DEPARTURE, self.handle_triage_departures),
+                              (WORKUP_DEPARTURE, self.handle_workup_departures),
+                              (SPECIALIST_DEPARTURE, self.handle_specialist_departures)):
+            mask = kinds == kind
+            if mask.any():
+                handler(rows[mask], patients[mask])
+        self.update_simulation_statistics(rows)
+
+    def run(self, until):
+        """
+        Processes events until the clock of every replication passes the given time, then
+        returns the results of every replication.
+        """
+        rows = np.flatnonzero(self.clock <= until)
+        while len(rows):
+            self.step(rows)
+            rows = rows[self.clock[rows] <= until]
+        return self.results()
+
+    def results(self):
+        """
+        Calculates the statistics of every replication, in the format of EDSimulation.results().
+        """
+        results = []
+        for i in range(self.number_of_replications):
+            # Time over which the statistics were collected, as in EDSimulation.results()
+            clock = self.clock[i] - self.warmup_time if self.clock[i] > self.warmup_time else self.clock[i]
+            out = self.total_patients["out"][i]
+            nurses, doctors, specialists = (self.max_num_servers[server] for server in ("nurses", "doctors", "specialists"))
+            utilization = {
+                "Triage": self.server_uptime["Triage"][i] / (nurses * clock),
+                "Workup": self.server_uptime["Workup"][i] / (doctors * clock),
+                "Specialist": self.server_uptime["Specialist"][i] / (specialists * clock),
+            }
+            results.append({
+                'Time Weighted Average Queues': {queue: float(area[i] / clock) for queue, area in self.queue_areas.items()},
+                'Average Queue Time Per Customer': {queue: float(area[i] / out) for queue, area in self.queue_areas.items()},
+                'Max Queue Lengths': {queue: int(maximum[i]) for queue, maximum in self.max_queue_lengths.items()},
+                'Total Server Uptime': {server: float(uptime[i]) for server, uptime in self.server_uptime.items()},
+                'Server Utilization Rate': {server: float(rate * 100) for server, rate in utilization.items()},
+                'Server Idle Rate': {server: float((1 - rate) * 100) for server, rate in utilization.items()},
+                'Percentage of Time Ambulances Spent in Diversion': {
+                    'Ambulance Diversion': float(self.diversion_area[i] / (NUMBER_OF_AMBULANCES * clock) * 100)},
+            })
+        return results
+
+def run_batch(simulation_time, number_of_replications, seed_sequence, configuration=None):
+   return BatchedEDSimulation(number_of_replications, seed=seed_sequence, **(configuration or {})).run(simulation_time)
+
+def run_batched_replications(number_of_replications, simulation_time, seed=None, configuration=None,
+                             replications_per_batch=4096, max_workers=None):
+   """
+   Runs replications with the batched engine, in batches of replications_per_batch
+   spread over a pool of worker processes, and returns the list of their results. The
+   configuration is a dict of keyword arguments for BatchedEDSimulation.
+   """
+   sizes = [min(replications_per_batch, number_of_replications - start)
+            for start in range(0, number_of_replications, replications_per_batch)]
+   seed_sequences = hospital_sim.replication_seeds(len(sizes), seed)
+   if max_workers == 1 or len(sizes) == 1:
+      batches = [run_batch(simulation_time, size, seed_sequence, configuration) for size, seed_sequence in zip(sizes, seed_sequences)]
+   else:
+      with ProcessPoolExecutor(max_workers=max_workers) as executor:
+         batches = list(executor.map(run_batch, [simulation_time] * len(sizes), sizes, seed_sequences,
+                                     [configuration] * len(sizes)))
+   return [results for batch in batches for results in batch]
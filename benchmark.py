@@ -0,0 +1,171 @@
+"""
+Benchmark suite for the emergency department simulation.
+
+Measures, for fixed seeds, the number of events processed per second, the growth of the
+RSS and the peak number of allocated blocks and traced bytes of a replication, how they
+scale with the simulation time and the arrival rates, and the end-to-end wall time of
+main(). Every timing is repeated in fresh processes and its median run kept, so a single
+run slowed down (or sped up) by the rest of the machine does not decide the comparison.
+Results are written as JSON and can be compared against a stored baseline to catch
+performance regressions (on a quiet machine, timings of shared machines vary too much):
+
+   python benchmark.py --output results.json
+   python benchmark.py --baseline results.json
+
+The comparison fails (exit code 1) when a case processes events more than the tolerance
+slower than in the baseline.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import hospital_sim
+
+DAY = 24 * 60
+
+# (simulation time in days, arrival rate scale) of every case
+HORIZON_CASES = [(30, 1), (60, 1), (120, 1), (180, 1)]
+ARRIVAL_CASES = [(60, 1.5), (60, 2), (60, 3)]
+
+def scaled_arrival_rates(scale):
+   return {arrival_type: [rate * scale for rate in rates]
+           for arrival_type, rates in hospital_sim.ARRIVAL_RATES.items()}
+
+def peak_rss():
+   # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+   return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+def run_case(days, arrival_scale, seed, trace_allocations=False):
+   """
+   Runs one replication, counting events, and returns its measurements. Meant to run in a
+   fresh process so that the peak RSS belongs to this replication only; its growth is
+   measured from the peak RSS once the interpreter and NumPy are imported.
+
+   When tracing allocations, the number of allocated blocks is sampled every 1024 events
+   and the peak traced bytes are recorded. Both slow the simulation down, so timings of a
+   traced run are not meaningful.
+   """
+   simulation_time = days * DAY
+   baseline_rss = peak_rss()
+   baseline_blocks = sys.getallocatedblocks()
+   peak_blocks = baseline_blocks
+   if trace_allocations:
+      tracemalloc.start()
+   simulation = hospital_sim.EDSimulation(seed=seed, arrival_rates=scaled_arrival_rates(arrival_scale))
+   number_of_events = 0
+   # CPU time of the process, so time spent descheduled in favour of other processes is not counted
+   start = time.process_time()
+   if trace_allocations:
+      while simulation.clock <= simulation_time:
+         simulation.step()
+         number_of_events += 1
+         if number_of_events % 1024 == 0:
+            peak_blocks = max(peak_blocks, sys.getallocatedblocks())
+   else:
+      while simulation.clock <= simulation_time:
+         simulation.step()
+         number_of_events += 1
+   elapsed = time.process_time() - start
+
+   measurements = {
+      "days": days,
+      "arrival_scale": arrival_scale,
+      "events": number_of_events,
+      "seconds": elapsed,
+      "events_per_second": number_of_events / elapsed,
+      "peak_rss_bytes": peak_rss(),
+      "rss_growth_bytes": peak_rss() - baseline_rss,
+   }
+   if trace_allocations:
+      measurements["peak_allocated_blocks"] = max(peak_blocks, sys.getallocatedblocks()) - baseline_blocks
+      measurements["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+   return measurements
+
+def run_in_fresh_process(function, *args):
+   with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+      return executor.submit(function, *args).result()
+
+def time_main(number_of_replications, days, seed):
+   start = time.perf_counter()
+   hospital_sim.main(number_of_replications, days * DAY, seed=seed)
+   return time.perf_counter() - start
+
+def run_benchmarks(seed=0, quick=False, repeats=5):
+   cases = [(30, 1), (60, 2)] if quick else HORIZON_CASES + ARRIVAL_CASES
+   results = {
+      "python": platform.python_version(),
+      "machine": platform.machine(),
+      "seed": seed,
+      "repeats": repeats,
+      "cases": {},
+   }
+   for days, arrival_scale in cases:
+      runs = sorted((run_in_fresh_process(run_case, days, arrival_scale, seed) for _ in range(repeats)),
+                    key=lambda run: run["events_per_second"])
+      measurements = runs[len(runs) // 2]
+      # Allocations are traced in a separate run, tracing slows the simulation down
+      traced = run_in_fresh_process(run_case, days, arrival_scale, seed, True)
+      measurements["peak_allocated_blocks"] = traced["peak_allocated_blocks"]
+      measurements["peak_traced_bytes"] = traced["peak_traced_bytes"]
+      results["cases"][f"{days}d_x{arrival_scale}"] = measurements
+
+   number_of_replications, days = (2, 30) if quick else (10, 180)
+   times = sorted(time_main(number_of_replications, days, seed) for _ in range(repeats))
+   results["main"] = {
+      "replications": number_of_replications,
+      "days": days,
+      "seconds": times[len(times) // 2],
+   }
+   return results
+
+def compare(results, baseline, tolerance):
+   """
+   Returns the list of regressions of the results against the baseline: cases whose events
+   per second dropped, or whose main() wall time grew, by more than the tolerance, both
+   taken from the median of their repeated runs.
+   """
+   regressions = []
+   for name, measurements in results["cases"].items():
+      if name not in baseline["cases"]:
+         continue
+      before = baseline["cases"][name]["events_per_second"]
+      after = measurements["events_per_second"]
+      if after < before * (1 - tolerance):
+         regressions.append(f"{name}: {after:.0f} events/s, baseline {before:.0f} events/s")
+
+   if baseline.get("main", {}).get("replications") == results["main"]["replications"] and \
+      baseline["main"]["days"] == results["main"]["days"]:
+      before, after = baseline["main"]["seconds"], results["main"]["seconds"]
+      if after > before * (1 + tolerance):
+         regressions.append(f"main: {after:.1f} s, baseline {before:.1f} s")
+   return regressions
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+   parser.add_argument("--seed", type=int, default=0)
+   parser.add_argument("--quick", action="store_true", help="run a reduced set of short cases")
+   parser.add_argument("--output", help="file to write the results to (default: stdout)")
+   parser.add_argument("--baseline", help="results file to compare against")
+   parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown (default: 0.10)")
+   parser.add_argument("--repeats", type=int, default=5, help="runs of every timing, the median is kept (default: 5)")
+   arguments = parser.parse_args()
+
+   results = run_benchmarks(arguments.seed, arguments.quick, arguments.repeats)
+   if arguments.output:
+      with open(arguments.output, "w") as file:
+         json.dump(results, file, indent=2)
+   else:
+      print(json.dumps(results, indent=2))
+
+   if arguments.baseline:
+      with open(arguments.baseline) as file:
+         regressions = compare(results, json.load(file), arguments.tolerance)
+      for regression in regressions:
+         print(f"Regression: {regression}", file=sys.stderr)
+      sys.exit(1 if regressions else 0)
@@ -0,0 +1,207 @@
+"""
+Event traces of the emergency department simulation.
+
+A TraceWriter attached to an EDSimulation records every processed event, together with the
+state of the queues and servers right after it was handled, in an append-only binary file.
+Records are buffered and written in chunks; every chunk stores each column contiguously,
+so a TraceReader can memory-map the file and filter or replay the trace without rerunning
+the model:
+
+   simulation = EDSimulation(seed=1)
+   with TraceWriter("run.edtrace", simulation):
+      simulation.run(24 * 60 * 180)
+
+   trace = TraceReader("run.edtrace")
+   # Ambulance arrivals (event type 1, see EVENT_TYPES) of triage type 2 patients
+   ambulance_arrivals = trace.select(event_type=1, triage_type=2)
+
+File layout: the magic bytes, the length of a JSON header describing the columns, the
+header, then chunks made of a row count followed by the columns of the chunk, each padded
+to a multiple of 8 bytes.
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"EDTRACE1"
+
+COLUMNS = [
+   ("time", "<f8"),
+   ("event_type", "<i1"),
+   ("patient_id", "<i8"),
+   ("arrival_type", "<i1"),
+   ("triage_type", "<i1"),
+   ("zone", "<i1"),
+   ("triage_queue", "<i4"),
+   ("bed_queue", "<i4"),
+   ("workup_queue", "<i4"),
+   ("specialist_queue", "<i4"),
+   ("busy_nurses", "<i2"),
+   ("busy_doctors", "<i2"),
+   ("busy_specialists", "<i2"),
+   ("diverted_ambulances", "<i2"),
+]
+
+EVENT_TYPES = {
+   0: "WalkInArrivalEvent",
+   1: "AmbulanceHospitalArrivalEvent",
+   3: "DepartureAmbulanceEvent",
+   4: "DepartureTriageEvent",
+   5: "DepartureWorkupEvent",
+   6: "DepartureSpecialistEvent",
+}
+
+TRACE_DTYPE = np.dtype(COLUMNS)
+
+def _padding(size):
+   return -size % 8
+
+class TraceWriter():
+    """
+      Records the events processed by a simulation into a trace file. Records are kept as
+      tuples and converted to columns in bulk once chunk_size of them are buffered.
+      Missing values (e.g. the zone of a patient without a bed) are written as -1.
+    """
+    def __init__(self, path, simulation=None, chunk_size=65536):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._records = []
+        self._file = open(path, "wb")
+        header = json.dumps({"columns": COLUMNS, "event_types": EVENT_TYPES}).encode()
+        self._file.write(MAGIC + struct.pack("<I", len(header)) + header + b"\0" * _padding(len(MAGIC) + 4 + len(header)))
+        if simulation is not None:
+            self.attach(simulation)
+
+    def attach(self, simulation):
+        """
+        Wraps the event handlers of the simulation so that every handled event gets recorded.
+        """
+        simulation.handlers = {event_type: self._recording_handler(simulation, handler)
+                               for event_type, handler in simulation.handlers.items()}
+
+    def _recording_handler(self, simulation, handler):
+        records = self._records
+        def recording_handler(event):
+            handler(event)
+            patient = event.patient
+            records.append((
+                event.time,
+                event.type,
+                patient.patient_id,
+                -1 if patient.arrival_type is None else patient.arrival_type,
+                -1 if patient.triage_type is None else patient.triage_type,
+                -1 if patient.zone is None else patient.zone,
+                simulation.number_triage_queue,
+                simulation.number_waiting_for_bed_queue,
+                simulation.number_workup_queue,
+                simulation.number_specialist_queue,
+                simulation.status_triage_nurses,
+                simulation.status_workup_doctors,
+                simulation.status_specialists,
+                simulation.diverted_ambulances,
+            ))
+            if len(records) >= self.chunk_size:
+                self.flush()
+        return recording_handler
+
+    def flush(self):
+        if not self._records:
+            return
+        chunk = np.array(self._records, dtype=TRACE_DTYPE)
+        self._records.clear()
+        self._file.write(struct.pack("<Q", len(chunk)))
+        for name, _ in COLUMNS:
+            column = chunk[name].tobytes()
+            self._file.write(column + b"\0" * _padding(len(column)))
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+class TraceReader():
+    """
+      Memory-mapped reader of a trace file. Columns of every chunk are exposed as views on
+      the file, so only the data actually used gets read from disk.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._data = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(self._data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a simulation trace")
+        (header_length,) = struct.unpack("<I", bytes(self._data[len(MAGIC):len(MAGIC) + 4]))
+        offset = len(MAGIC) + 4
+        header = json.loads(bytes(self._data[offset:offset + header_length]))
+        self.columns = [(name, np.dtype(dtype)) for name, dtype in header["columns"]]
+        self.event_types = {int(event_type): name for event_type, name in header["event_types"].items()}
+        offset += header_length + _padding(offset + header_length)
+
+        # Locate the chunks once, their columns are only mapped when read
+        self._chunks = []
+        while offset < len(self._data):
+            (rows,) = struct.unpack("<Q", bytes(self._data[offset:offset + 8]))
+            offset += 8
+            self._chunks.append((rows, offset))
+            for _, dtype in self.columns:
+                size = rows * dtype.itemsize
+                offset += size + _padding(size)
+
+    def __len__(self):
+        return sum(rows for rows, _ in self._chunks)
+
+    def chunks(self, names=None):
+        """
+        Yields every chunk as a dict of column name to (memory-mapped) array.
+        """
+        names = set(names) if names is not None else None
+        for rows, offset in self._chunks:
+            chunk = {}
+            for name, dtype in self.columns:
+                size = rows * dtype.itemsize
+                if names is None or name in names:
+                    chunk[name] = self._data[offset:offset + size].view(dtype)
+                offset += size + _padding(size)
+            yield chunk
+
+    def read(self, names=None):
+        """
+        Returns the given columns (all by default) over the whole trace.
+        """
+        chunks = list(self.chunks(names))
+        names = [name for name, _ in self.columns if names is None or name in names]
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) if chunks else np.array([])
+                for name in names}
+
+    def select(self, start=None, end=None, **conditions):
+        """
+        Returns all columns of the records with start <= time <= end whose columns equal the
+        given values, e.g. select(event_type=6, triage_type=1).
+        """
+        selected = []
+        for chunk in self.chunks():
+            mask = np.ones(len(chunk["time"]), dtype=bool)
+            if start is not None:
+                mask &= chunk["time"] >= start
+            if end is not None:
+                mask &= chunk["time"] <= end
+            for name, value in conditions.items():
+                mask &= chunk[name] == value
+            selected.append({name: column[mask] for name, column in chunk.items()})
+        return {name: np.concatenate([chunk[name] for chunk in selected]) if selected else np.array([])
+                for name, _ in self.columns}
+
+    def replay(self, start=None, end=None, **conditions):
+        """
+        Yields the selected records one at a time, in order, as dicts.
+        """
+        columns = self.select(start, end, **conditions)
+        names = list(columns)
+        for values in zip(*(columns[name].tolist() for name in names)):
+            yield dict(zip(names, values))
@@ -1,17 +1,39 @@
-from random import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import heapq
 import math
+import os
+import pickle
+import threading
+import time
+import zlib
 
 class Patient():
     """
       Object used to represent a patient. Each patient gets assigned differentiating attributes
       such as their arrival type, their triage status (1-5), and to a location in the ED.
+      The simulation clock is stamped on the patient as they go through each stage (None
+      for the stages not reached yet or skipped, e.g. triage for ambulance arrivals).
     """
-    def __init__(self, arrival_type=None, triage_type = None, zone=None, complaint=None):
+    __slots__ = ("arrival_type", "triage_type", "zone", "complaint", "patient_id",
+                 "arrival_time", "triage_start", "triage_end", "bed_time", "workup_start", "workup_end",
+                 "specialist_start", "departure_time")
+
+    def __init__(self, arrival_type=None, triage_type = None, zone=None, complaint=None, patient_id=None):
+        self.patient_id = patient_id
         self.arrival_type = arrival_type
         self.triage_type = triage_type
         self.zone = zone
         self.complaint = complaint
+        self.arrival_time = None
+        self.triage_start = None
+        self.triage_end = None
+        self.bed_time = None
+        self.workup_start = None
+        self.workup_end = None
+        self.specialist_start = None
+        self.departure_time = None
     
     def assign_patient_arrival_type(self, arrival_type):
         types = {
@@ -20,10 +42,10 @@ class Patient():
         }
         self.arrival_type = types[arrival_type]
 
-    def assign_triage_type(self, triage_type):
+    def assign_triage_type(self, triage_type, variates):
         self.triage_type = triage_type
         if triage_type in {1,2,4}:
-            r = random()
+            r = variates.random("complaint")
             if r <= 0.5:
                 self.complaint = 1 # 1 - Trauma, 2 - Stoke, 4 - Laceration
             else:
@@ -40,6 +62,8 @@ class Event():
       specific kinds of events. Each event contains attributes for time of occurrence
       and associated patient.
     """
+    __slots__ = ("type", "patient", "time")
+
     def __init__(self, type=None, patient=None, time=None):
         self.type = type
         self.patient = patient
@@ -66,6 +90,8 @@ class Event():
        return f"Event Type: {types[self.type]}"   
          
 class AmbulanceHospitalArrivalEvent(Event):
+    __slots__ = ("diverted_ambulance",)
+
     def __init__(self, time=None, patient=None, diverted_ambulance=False):
         super().__init__(type=1, patient=patient, time=time)
         self.diverted_ambulance = diverted_ambulance
@@ -74,150 +100,508 @@ class AmbulanceHospitalArrivalEvent(Event):
         self.diverted_ambulance = True
 
 class WalkInArrivalEvent(Event):
+    __slots__ = ()
+
     def __init__(self, time=None, patient=None):
         super().__init__(type=0, patient=patient, time=time)  
 
 class DepartureAmbulanceEvent(Event):
+    __slots__ = ()
+
     def __init__(self, time=None, patient=None):
         super().__init__(type=3, patient=patient, time=time)    
 
 class DepartureTriageEvent(Event):
+    __slots__ = ()
+
     def __init__(self, patient=None, time=None):
         super().__init__(type=4, patient=patient, time=time)
 
 class DepartureWorkupEvent(Event):
+    __slots__ = ()
+
     def __init__(self, patient=None, time=None):
         super().__init__(type=5, patient=patient, time=time)
 
 class DepartureSpecialistEvent(Event):
+    __slots__ = ()
+
     def __init__(self, patient=None, time=None):
         super().__init__(type=6, patient=patient, time=time)
 
 class EndSimulationEvent(Event):
+    __slots__ = ()
+
     def __init__(self, time=None):
         super().__init__(type="End Simulation", time=time)
 
-def generate_interarrival_time(clock, arrival_type):
-      """
-      Generates interarrival time using lambda value of number of patients / hour. 
-      """
-      r = random()
-      a = 0
-      hours = clock % (24 * 60) / 60
-
-      if ((hours >= 0 and hours <= 7) or hours == 23):
-          a = 6 if arrival_type == 1 else 14
-      elif (hours >= 7 and hours <= 11):
-          a = 9 if arrival_type == 1 else 10
-      elif (hours >= 12 and hours <= 17):
-          a = 15 if arrival_type == 1 else 10
-      else:
-          a = 18 if arrival_type == 1 else 12
-      
-      return (math.log(1 - r)/(a/60)) * -1
-
-def generate_triage_time(patient):
+class EventPool():
+    """
+      Free list of handled events that can be reused for new events of the same kind,
+      instead of allocating a new object for every event. At most max_size events are kept
+      per kind; a pool with max_size 0 never recycles anything.
+    """
+    __slots__ = ("max_size", "_free")
+
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        self._free = {}
+
+    def acquire(self, event_class, **attributes):
+        free = self._free.get(event_class)
+        if free:
+            event = free.pop()
+            event.__init__(**attributes)
+            return event
+        return event_class(**attributes)
+
+    def release(self, event):
+        free = self._free.setdefault(type(event), [])
+        if len(free) < self.max_size:
+            event.patient = None
+            free.append(event)
+
+class FutureEventList():
+    """
+      Priority queue of scheduled events ordered by event time. Events with equal times
+      are returned in the order they were scheduled, which matches the ordering the
+      simulation had when the FEL was a list re-sorted (stably) after every event.
+
+      Scheduling and popping are O(log n). Cancelled events are left in the heap and
+      discarded lazily when they reach the front.
+    """
+    def __init__(self, events=()):
+        self._heap = []
+        self._sequence = 0
+        self._cancelled = set()
+        for event in events:
+            self.schedule(event)
+
+    def schedule(self, event):
+        heapq.heappush(self._heap, (event.time, self._sequence, event))
+        self._sequence += 1
+
+    def append(self, event):
+        self.schedule(event)
+
+    def cancel(self, event):
+        self._cancelled.add(event)
+
+    def pop(self):
+        while self._heap:
+            _, _, event = heapq.heappop(self._heap)
+            if event in self._cancelled:
+                self._cancelled.discard(event)
+                continue
+            return event
+        raise IndexError("pop from empty future event list")
+
+    def peek(self):
+        while self._heap and self._heap[0][2] in self._cancelled:
+            _, _, event = heapq.heappop(self._heap)
+            self._cancelled.discard(event)
+        return self._heap[0][2] if self._heap else None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Instrumentation may wrap pop on the instance, it is not part of the state
+        state.pop("pop", None)
+        return state
+
+    def __len__(self):
+        return len(self._heap) - len(self._cancelled)
+
+    def __iter__(self):
+        """
+        Iterates over the scheduled (non-cancelled) events in the order they will be processed.
+        """
+        for _, _, event in sorted(self._heap, key=lambda entry: entry[:2]):
+            if event not in self._cancelled:
+                yield event
+
+class TimeWeightedStatistic():
+    """
+      Running accumulator for a piecewise-constant quantity such as a queue length or the
+      number of busy servers. Only sums are kept, so memory does not grow with the number
+      of events: the time-weighted area, the area of the squares (for the time-average
+      variance), the total observed time and the maximum.
+
+      If a window length is given, the area is also split into fixed windows (e.g. 60 for
+      hourly or 1440 for daily snapshots), keeping one sum per window.
+    """
+    def __init__(self, window_length=None):
+        self.area = 0
+        self.area_of_squares = 0
+        self.time = 0
+        self.maximum = 0
+        self.window_length = window_length
+        self.window_areas = {}
+
+    def record(self, value, start, end):
+        """
+        Records that the quantity had the given value from start to end.
+        """
+        delta_t = end - start
+        self.area += delta_t * value
+        self.area_of_squares += delta_t * value * value
+        self.time += delta_t
+        self.maximum = max(self.maximum, value)
+
+        if self.window_length and value:
+            window_length = self.window_length
+            window = int(start // window_length)
+            while start < end:
+                window_end = min(end, (window + 1) * window_length)
+                self.window_areas[window] = self.window_areas.get(window, 0) + (window_end - start) * value
+                start = window_end
+                window += 1
+
+    def mean(self):
+        return self.area / self.time if self.time else 0
+
+    def variance(self):
+        """
+        Time-average variance of the quantity over the observed time.
+        """
+        if not self.time:
+            return 0
+        return max(self.area_of_squares / self.time - self.mean() ** 2, 0)
+
+    def windows(self):
+        """
+        Returns a list of (window start time, time-average value) for every window from the
+        first to the last one recorded.
+        """
+        if not self.window_areas:
+            return []
+        first, last = min(self.window_areas), max(self.window_areas)
+        return [(window * self.window_length, self.window_areas.get(window, 0) / self.window_length)
+                for window in range(first, last + 1)]
+
+class QuantileSketch():
+    """
+      Streaming quantile estimator for non-negative values such as waiting times, in the
+      style of DDSketch: values are counted in logarithmically sized buckets, so every
+      quantile is returned with a relative error of at most relative_accuracy whatever the
+      distribution. Memory is bounded by the number of buckets (about 230 per decade of
+      values at 1% accuracy); past max_buckets, the lowest buckets are collapsed together.
+      Sketches with the same accuracy can be merged, e.g. to combine patient groups.
+    """
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        buckets = self.buckets
+        buckets[index] = buckets.get(index, 0) + 1
+        if len(buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        indices = sorted(self.buckets)
+        lowest = indices[len(indices) - self.max_buckets]
+        for index in indices[:len(indices) - self.max_buckets]:
+            self.buckets[lowest] += self.buckets.pop(index)
+
+    def merge(self, other):
+        """
+        Adds the values counted by another sketch (of the same accuracy) to this one.
+        """
+        if other._gamma != self._gamma:
+            raise ValueError("Only sketches with the same relative accuracy can be merged")
+        for index, bucket_count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + bucket_count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+        while len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def quantile(self, q):
+        """
+        Returns the q-quantile (0 <= q <= 1) of the values added so far.
+        """
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket (gamma^(i-1), gamma^i] in relative terms
+                return min(2 * self._gamma ** index / (self._gamma + 1), self.maximum)
+        return self.maximum
+
+class VariatePool():
+    """
+      Source of the random variates used by the simulation. Each distribution (i.e. each
+      kind and set of parameters, and purpose for plain uniforms) has its own buffer, which
+      is filled with a large batch of values drawn at once and handed out in order. Buffers
+      are refilled lazily when they run out.
+
+      Every buffer draws from its own Generator, derived from the seed of the pool's
+      Generator and the distribution, so the n-th variate of a distribution is the same
+      whatever was drawn from the other distributions in between.
+
+      All variates are produced from standard uniforms by inverse transform. An antithetic
+      pool hands out the complement 1 - u of every uniform u, so that a run with antithetic
+      streams mirrors the run with the same seed (low service times become high ones, etc.).
+    """
+    def __init__(self, generator=None, batch_size=1024, antithetic=False):
+        self.generator = generator if generator is not None else np.random.default_rng()
+        self.batch_size = batch_size
+        self.antithetic = antithetic
+        self._buffers = {}
+        self._generators = {}
+        self.uniforms_generated = 0
+
+    def _generator(self, key):
+        generator = self._generators.get(key)
+        if generator is None:
+            seed_sequence = self.generator.bit_generator.seed_seq
+            child = np.random.SeedSequence(seed_sequence.entropy,
+                                           spawn_key=seed_sequence.spawn_key + (zlib.crc32(repr(key).encode()),))
+            generator = self._generators[key] = np.random.default_rng(child)
+        return generator
+
+    def uniforms(self, size=None, key=None):
+        """
+        Returns an array of standard uniforms (a full batch by default), from the Generator
+        of the given distribution key (the pool's Generator by default).
+        """
+        size = self.batch_size if size is None else size
+        self.uniforms_generated += size
+        generator = self.generator if key is None else self._generator(key)
+        uniforms = generator.random(size)
+        if self.antithetic:
+            uniforms = 1 - uniforms
+            uniforms[uniforms == 1] = 0 # Stay in [0, 1), the inverse transforms rely on it
+        return uniforms
+
+    def draws(self):
+        """
+        Number of variates drawn so far, i.e. generated and no longer waiting in a buffer.
+        """
+        return self.uniforms_generated - sum(len(buffer) for buffer in self._buffers.values())
+
+    def _refill(self, key, values):
+        # Reversed so that values are handed out in order with list.pop()
+        buffer = values[::-1].tolist()
+        self._buffers[key] = buffer
+        return buffer.pop()
+
+    def random(self, purpose=None):
+        """
+        Standard uniform variate. Draws made for different purposes (e.g. the triage type
+        and the chief complaint) can be kept in separate sequences by naming the purpose.
+        """
+        key = "random" if purpose is None else ("random", purpose)
+        buffer = self._buffers.get(key)
+        if buffer:
+            return buffer.pop()
+        return self._refill(key, self.uniforms(key=key))
+
+    def uniform(self, low, high):
+        key = ("uniform", low, high)
+        buffer = self._buffers.get(key)
+        if buffer:
+            return buffer.pop()
+        return self._refill(key, low + (high - low) * self.uniforms(key=key))
+
+    def triangular(self, left, mode, right):
+        key = ("triangular", left, mode, right)
+        buffer = self._buffers.get(key)
+        if buffer:
+            return buffer.pop()
+        u = self.uniforms(key=key)
+        c = (mode - left) / (right - left)
+        values = np.where(u < c,
+                          left + np.sqrt(u * (right - left) * (mode - left)),
+                          right - np.sqrt((1 - u) * (right - left) * (right - mode)))
+        return self._refill(key, values)
+
+    def exponential(self):
+        """
+        Standard exponential variate (mean 1).
+        """
+        buffer = self._buffers.get("exponential")
+        if buffer:
+            return buffer.pop()
+        return self._refill("exponential", -np.log1p(-self.uniforms(key="exponential")))
+
+# Arrival rates (patients / hour) for each hour of the day, per arrival type (0 - ambulance
+# dispatch, 1 - walk-in). Hours 11, 17 and 23 fall in the evening band as they always have.
+ARRIVAL_RATES = {
+    0: [14] * 7 + [10] * 4 + [12] + [10] * 5 + [12] * 7,
+    1: [6] * 7 + [9] * 4 + [18] + [15] * 5 + [18] * 7,
+}
+
+class ArrivalSchedule():
+    """
+      Non-homogeneous Poisson arrival stream with a piecewise constant rate that repeats
+      every day (one rate per hour by default, though any number of equal periods works).
+
+      Arrival times are generated by inversion in vectorized batches: the cumulative sums
+      of standard exponentials are mapped through the inverse of the cumulative rate
+      function, which is piecewise linear. Times are handed out in order by next_arrival()
+      and new batches are generated lazily, so any horizon can be covered.
+    """
+    def __init__(self, hourly_rates, variates: VariatePool, start=0):
+        self.hourly_rates = list(hourly_rates)
+        rates = np.asarray(hourly_rates, dtype=float)
+        period_length = (24 * 60) / len(rates)
+        self._breakpoints = np.arange(len(rates) + 1) * period_length
+        self._cumulative_rates = np.concatenate(([0], np.cumsum(rates / 60 * period_length)))
+        self._daily_rate = self._cumulative_rates[-1]
+        self._variates = variates
+        # Cumulative rate at the start time, arrivals are generated from there onwards
+        self._position = self._cumulative_rate(start)
+        self._buffer = []
+
+    def _cumulative_rate(self, time):
+        day, time_of_day = divmod(time, 24 * 60)
+        return day * self._daily_rate + np.interp(time_of_day, self._breakpoints, self._cumulative_rates)
+
+    def _arrival_times(self, cumulative_rates):
+        day, remainder = np.divmod(cumulative_rates, self._daily_rate)
+        return day * 24 * 60 + np.interp(remainder, self._cumulative_rates, self._breakpoints)
+
+    def _generate_batch(self):
+        exponentials = -np.log1p(-self._variates.uniforms())
+        cumulative_rates = self._position + np.cumsum(exponentials)
+        self._position = cumulative_rates[-1]
+        # Reversed so that arrivals are handed out in order with list.pop()
+        self._buffer = self._arrival_times(cumulative_rates)[::-1].tolist()
+
+    def draws(self):
+        """
+        Number of variates of the pool used so far, i.e. arrival times handed out (the pool
+        itself counts the whole batches the schedule took from it).
+        """
+        return self._variates.draws() - len(self._buffer)
+
+    def next_arrival(self):
+        if not self._buffer:
+            self._generate_batch()
+        return self._buffer.pop()
+
+    def arrivals_until(self, horizon):
+        """
+        Generates all the remaining arrivals up to the horizon at once and returns them as an
+        array. Arrivals generated past the horizon are kept for next_arrival().
+        """
+        times = np.array(self._buffer[::-1])
+        target = self._cumulative_rate(horizon)
+        if self._position < target:
+            expected = target - self._position
+            size = int(expected + 10 * np.sqrt(expected)) + 1
+            cumulative_rates = self._position + np.cumsum(-np.log1p(-self._variates.uniforms(size)))
+            while cumulative_rates[-1] < target:
+                extra = np.cumsum(-np.log1p(-self._variates.uniforms(size)))
+                cumulative_rates = np.concatenate((cumulative_rates, cumulative_rates[-1] + extra))
+            self._position = cumulative_rates[-1]
+            times = np.concatenate((times, self._arrival_times(cumulative_rates)))
+
+        self._buffer = times[times > horizon][::-1].tolist()
+        return times[times <= horizon]
+
+def generate_triage_time(patient, variates: VariatePool):
    """
    Generates service time for triage assessment (only for walk-in patients)
    """
    if (patient.triage_type == 3):
-      return np.random.uniform(0.75, 2.25) # More urgent triaging for type 3
-   return np.random.uniform(7.5, 11.25)
+      return variates.uniform(0.75, 2.25) # More urgent triaging for type 3
+   return variates.uniform(7.5, 11.25)
    
-def generate_workup_service_time(patient):
+def generate_workup_service_time(patient, variates: VariatePool):
    """
    Generates workup service time for patients of different triage types and 
    associated chief complaints.
    """
    if (patient.triage_type == 1):
        if (patient.complaint == 1):
-           return np.random.uniform(5, 12)
+           return variates.uniform(5, 12)
        else:
-           return np.random.uniform(2, 5)
+           return variates.uniform(2, 5)
    elif (patient.triage_type == 2):
        if (patient.complaint == 1):
-             return np.random.uniform(5, 15)
+             return variates.uniform(5, 15)
        else:
            return 2
    elif (patient.triage_type == 3):
-       return np.random.uniform(5, 10)
+       return variates.uniform(5, 10)
    elif (patient.triage_type == 4):
        return 2
    else:
-       return np.random.uniform(5, 10)
-
-def generate_procedure_time(patient):
+       return variates.uniform(5, 10)
+
+# Procedures performed by specialists: procedure id -> (name, distribution, parameters)
+PROCEDURES = {
+    1: ("X-ray", "uniform", (3, 5)),
+    2: ("Surgery Type A", "triangular", (10, 25, 50)),
+    3: ("Surgery Type B", "triangular", (30, 45, 90)),
+    4: ("ECG", "uniform", (7, 10)),
+    5: ("CT Scan", "uniform", (10, 25)),
+    6: ("Medication", "uniform", (2, 5)),
+    7: ("Oxygen Therapy", "uniform", (5, 10)),
+    8: ("Nebulizer", "uniform", (2, 3)),
+    9: ("Cast/Splint", "uniform", (5, 15)),
+    10: ("Stitches", "triangular", (10, 15, 25)),
+    11: ("Tetanus Shot", "uniform", (2, 5)),
+}
+
+# Procedure mix per (triage type, chief complaint): list of (probability, procedure id).
+# Each procedure in the list is performed independently with its probability.
+PROCEDURE_MIX = {
+    (1, 1): [(0.9, 1), (0.8, 2)], # Trauma
+    (1, 2): [(0.95, 4), (0.6, 3)], # Cardiac
+    (2, 1): [(0.9, 5), (0.8, 6)], # Stroke
+    (2, 2): [(0.9, 7), (0.7, 8)], # Severe Asthma
+    (3, 1): [(0.8, 1), (0.7, 9)], # Broken Limb
+    (4, 1): [(0.75, 10), (0.3, 11)], # Laceration
+    (4, 2): [(0.6, 8), (0.3, 7)], # Mild Asthma
+    (5, 1): [(0.9, 6)], # Common Cold
+}
+
+def generate_procedure_time(patient, variates: VariatePool, procedure_mix=PROCEDURE_MIX):
    """
    Generates service time for specialist assessment based on their triage type
-   and associated chief complaint.
+   and associated chief complaint. Only the durations of the procedures that are
+   actually performed get sampled.
    """
-   procedure_times = {
-       1 : np.random.uniform(3, 5), # X-ray
-       2: np.random.triangular(10, 25, 50, 1)[0], # Surgery Type A
-       3: np.random.triangular(30, 45, 90, 1)[0], # Surgery Type B
-       4: np.random.uniform(7, 10), # ECG
-       5: np.random.uniform(10, 25), # CT Scan
-       6: np.random.uniform(2, 5), # Medication
-       7: np.random.uniform(5, 10), # Oxygen Therapy
-       8: np.random.uniform(2, 3), # Nebulizer
-       9: np.random.uniform(5, 15), # Cast/Splint
-       10: np.random.triangular(10, 15, 25, 1)[0], # Stitches
-       11: np.random.uniform(2, 5), # Tetanus Shot
-   }
-
    total_time = 0
-   r1 = random()
-   r2 = random()
-
-   if (patient.triage_type == 1):
-       if (patient.complaint == 1):
-           if r1 <= 0.9:
-               total_time += procedure_times.get(1)
-           if r2 <= 0.8:
-               total_time += procedure_times.get(2)
-       else:
-            if r1 <= 0.95:
-                total_time += procedure_times.get(4)
-            if r2 <= 0.6:
-                total_time += procedure_times.get(3)
-   elif (patient.triage_type == 2):
-       if (patient.complaint == 1):
-           if r1 <= 0.9:
-               total_time += procedure_times.get(5)
-           if r2 <= 0.8:
-               total_time += procedure_times.get(6)
-       else:
-           if r1 <= 0.9:
-               total_time += procedure_times.get(7)
-           if r2 <= 0.7:
-               total_time += procedure_times.get(8)
-   elif (patient.triage_type == 3):
-       if r1 <= 0.8:
-           total_time += procedure_times.get(1)
-       if r2 <= 0.7:
-           total_time += procedure_times.get(9)
-   elif (patient.triage_type == 4):
-       if (patient.complaint == 1):
-            if r1 <= 0.75:
-               total_time += procedure_times.get(10)
-            if r2 <= 0.3:
-               total_time += procedure_times.get(11)
-       else: 
-            if r1 <= 0.6:
-               total_time += procedure_times.get(8)
-            if r2 <= 0.3:
-               total_time += procedure_times.get(7)
-   else:
-       if r1 <= 0.9:
-           total_time += procedure_times.get(6)
+   for probability, procedure in procedure_mix[(patient.triage_type, patient.complaint)]:
+       if variates.random(("performed", procedure)) <= probability:
+           _, distribution, parameters = PROCEDURES[procedure]
+           total_time += getattr(variates, distribution)(*parameters)
    return total_time
 
-def generate_ambulance_arrival_triage_type():
+def generate_ambulance_arrival_triage_type(variates: VariatePool):
    """
    Assigns triage type for ambulance patients (limited to types 1,2,3,4)
    """
    triage_type = None
-   r = random()
+   r = variates.random("ambulance_triage_type")
    if r <= 0.2:
       triage_type = 1
    elif r <= 0.55:
@@ -228,11 +612,11 @@ def generate_ambulance_arrival_triage_type():
       triage_type = 4
    return triage_type
 
-def generate_walk_in_triage_type():
+def generate_walk_in_triage_type(variates: VariatePool):
    """
    Assigns triage type for walk-in patients (limited to types 3,4,5)
    """
-   r = random()
+   r = variates.random("walk_in_triage_type")
    triage_type = 0
    if r <= 0.33333:
          triage_type = 3
@@ -242,585 +626,1099 @@ def generate_walk_in_triage_type():
          triage_type = 5  
    return triage_type
 
-def emergency_department_simulation(simulation_time):
-   global clock
-   global fel
-   global max_num_servers
-   global status_triage_nurses
-   global status_workup_doctors
-   global status_specialists
-   global total_patients
-   global max_queue_lengths 
-   global number_triage_queue
-   global number_waiting_for_bed_queue  
-   global number_workup_queue 
-   global number_specialist_queue
-   global number_of_beds_per_zone
-   global interrupt_lists
-   global bed_queue_lists
-   global workup_queue_lists
-   global triage_queue_list
-   global specialist_queue_list
-   global time_weighted_queue
-   global server_uptime
-   global total_interrupts
-   global available_ambulances
-   global diverted_ambulances
-   global time_in_diversion
-
-   clock = 0
-   
-   available_ambulances = 10
-   diverted_ambulances = 0
-
-   # FEL starts off with an arrival of both ambulance and walk-in at t = 0
-   initial_ambulance_patient = Patient(arrival_type=0)
-   initial_walkin_patient = Patient(arrival_type=1)
-   available_ambulances -= 1
-   fel = [DepartureAmbulanceEvent(time=0, patient=initial_ambulance_patient), 
-          WalkInArrivalEvent(time=0, patient=initial_walkin_patient)]
-
-   # Set number of servers available for each process
-   max_num_servers = {
-       "doctors":2,
-       "nurses":2,
-       "specialists":5,
-   }
-
-   # Set number of beds available per zone
-   number_of_beds_per_zone = {
-      1 : 12,
-      2 : 8, 
-      3 : 10, 
-      4 : 10, 
-   }
-
-   # State Variables - Resource Statuses
-   status_workup_doctors = 0
-   status_triage_nurses = 0
-   status_specialists = 0
-
-   # State Variables - Queues
-   number_triage_queue = 0
-   number_waiting_for_bed_queue = 0
-   number_workup_queue = 0
-   number_specialist_queue = 0
-
-   # Lists of the patients interrupted by higher priority patients
-   interrupt_lists = {
-      "2":[],
-      "3,4,5":[],
-   }
-   # List of the patients waiting for beds
-   bed_queue_lists = {
-      "1":[],
-      "2":[],
-      "3,4,5":[]
-   }
-   # List of the patients in beds waiting for initial workup assessment
-   workup_queue_lists = {
-      "1": [],
-      "2": [],
-      "3,4,5": []
-   }
-   #List of the patients in the triage queue
-   triage_queue_list = []
-   # List of patients waiting to see specialist
-   specialist_queue_list = []
-
-   ######## Statistics to collect and update ########
-   total_interrupts = 0
-
-   total_patients = {
-       "in":0,
-       "out":0,
-   }
-   
-   max_queue_lengths = {
-       "Triage": 0,
-       "Bed": 0,
-       "Workup": 0,
-       "Specialist": 0
-   }
-
-   time_weighted_queue = {
-       "Triage": [],
-       "Bed": [],
-       "Workup": [],
-       "Specialist": [],
-   }
-
-   server_uptime = {
-       "Triage": [],
-       "Workup": [],
-       "Specialist": [],
-   }
-
-   time_in_diversion = []
-   ##################################################
-   def check_bed_queue(zone, patient):
-      """
-      Helper method used to remove patients waiting for a bed from the queue when another
-      patient exits the system (i.e., freeing up a bed).
-
-      Depending on the zone, first check if there is a queued patient that can go into that zone.
-      If there is an applicable patient, assign them to the zone and generate their departure
-      event for intial workup.
-      """
-      def give_bed_queued_patient(triage_type):
-         global number_workup_queue
-
-         patient.assign_bed_in_zone(zone)
-         if status_workup_doctors == max_num_servers["doctors"]:
-            number_workup_queue += 1
-            workup_queue_lists[triage_type].append(patient)
-         else:
-            workup_service_time = generate_workup_service_time(patient=patient)
-            fel.append(DepartureWorkupEvent(patient=patient, time=clock+workup_service_time))
-         return
-      
-      if zone in {3,4}:
-         # Zone 3 or 4 only serves patients of type 2,3,4,5 
-         if len(bed_queue_lists["2"]) > 0:
-            patient = bed_queue_lists["2"].pop()
-            give_bed_queued_patient("2")
-
-         elif len(bed_queue_lists["3,4,5"]) > 0:
-            patient = bed_queue_lists["3,4,5"].pop()
-            give_bed_queued_patient("3,4,5")
-
-      elif zone in {2}:
-         # Zone 2 only serves patients of type 1,2
-         if len(bed_queue_lists["1"]) > 0:
-            patient = bed_queue_lists["1"].pop()
-            give_bed_queued_patient("1")
-
-         elif len(bed_queue_lists["2"]) > 0:
-            patient = bed_queue_lists["2"].pop()
-            give_bed_queued_patient("2")
-
-      else:
-         # Zone 1 only serves patients of type 1
-         if len(bed_queue_lists["1"]) > 0:
-            patient = bed_queue_lists["1"].pop()
-            give_bed_queued_patient("1")
-      return
-   
-   def assign_type_3_4_5_patient_to_zone(patient: Patient, zone):
-      """
-      Helper method used to assign patients of type 3, 4, or 5 to a zone in the ED. There
-      is no priority interrupting between these types of patients.
-      """
-      global status_workup_doctors
-      global number_workup_queue
-
-      number_of_beds_per_zone[zone] -= 1 # Decrease number of available beds
-
-      patient.assign_bed_in_zone(zone)
-      if status_workup_doctors == max_num_servers["doctors"]: # Check for available doctors
-         number_workup_queue += 1
-         workup_queue_lists["3,4,5"].append(patient)
-      else:
-         status_workup_doctors += 1
-         patient.assign_bed_in_zone(zone)
-         workup_service_time = generate_workup_service_time(patient)
-         fel.append(DepartureWorkupEvent(patient=patient, time=clock + workup_service_time))   
-      return
-
-   def handle_arrival_event(event):
-      """
-         Method used to handles patient arrival events. Handling varies depending on arrival type 
-         (ambulance or walk-in). Triage type (1-5) is pre-determined for ambulance arrivals and walk-in 
-         patients must get serviced by triage nurses to determine their triage priority.
-         
-         Triage types 1 and 2 only occur as ambulance arrivals and type 5 only occur as walk-in patients.
-
-         To establish a process for priority, patients types 1 and 2 are capable of interrupting types 
-         lower than them, where they will seize the doctor currently serving another patient.
-      """
-      global status_triage_nurses
-      global number_triage_queue
-      global number_waiting_for_bed_queue
-      global available_ambulances
-      global diverted_ambulances
-
-      ################################## ARRIVAL EVENT HELPER METHODS ################################
-      
-      def assign_type_1_2_patient_to_zone(patient:Patient, zone):
-         """
-         Helper method used to assign patients of type 1 or 2 to a zone in the ED. These patients
-         can interrupt other patients of lower priority in service, but cannot interrupt their own
-         priority type.
-         """
-         global status_workup_doctors
-         global total_interrupts
-
-         number_of_beds_per_zone[zone] -= 1
-         patient.assign_bed_in_zone(zone)
-         workup_service_time = generate_workup_service_time(patient)
-         if status_workup_doctors == max_num_servers["doctors"]:
+# Statistics are only collected after the warmup period (in minutes)
+WARMUP_TIME = 20160
+
+# Default staffing: number of servers available for each process
+MAX_NUM_SERVERS = {
+    "doctors":2,
+    "nurses":2,
+    "specialists":5,
+}
+
+# Default number of beds available per zone
+NUMBER_OF_BEDS_PER_ZONE = {
+    1 : 12,
+    2 : 8, 
+    3 : 10, 
+    4 : 10, 
+}
+
+# Per-patient times (in minutes) computed from the stage timestamps when a patient leaves
+PATIENT_TIME_MEASURES = {
+    "Triage Wait": ("arrival_time", "triage_start"),
+    "Bed Wait": ("ready_for_bed", "bed_time"),
+    "Door to Doctor": ("arrival_time", "workup_start"),
+    "Specialist Wait": ("workup_end", "specialist_start"),
+    "Length of Stay": ("arrival_time", "departure_time"),
+}
+
+class RandomStreams():
+    """
+      Independent random number streams for each stochastic component of the simulation,
+      spawned from a single SeedSequence. Giving every component its own stream keeps, for
+      example, the arrival process identical between two runs with the same seed that only
+      differ in staffing (common random numbers). With antithetic, every stream hands out
+      the complements of the uniforms of the streams with the same seed.
+    """
+    components = (
+        "walk_in_arrivals",
+        "ambulance_dispatches",
+        "triage_types",
+        "triage_times",
+        "workup_times",
+        "procedures",
+        "ambulance_travel",
+    )
+
+    def __init__(self, seed=None, antithetic=False):
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.antithetic = antithetic
+        for component, child in zip(self.components, self.seed_sequence.spawn(len(self.components))):
+            setattr(self, component, VariatePool(np.random.default_rng(child), antithetic=antithetic))
+
+class SimulationProfiler():
+    """
+      Opt-in instrumentation of an EDSimulation. The profiler wraps the FEL pop, the event
+      handlers and the statistics update of the simulation it is attached to, so a
+      simulation without a profiler runs exactly the same code as before.
+
+      It counts events per event type, times the handlers (cumulative and p99, from a
+      histogram with quarter-octave bins) apart from the statistics update they end with,
+      which is timed on its own, samples the FEL size every fel_sample_interval minutes of
+      simulated time, and collects the random draws of every stream and the interrupt
+      scans. summary() exports everything as a dict.
+    """
+    histogram_bins = 160
+
+    def __init__(self, simulation, fel_sample_interval=60):
+        self.simulation = simulation
+        self.fel_sample_interval = fel_sample_interval
+        self.event_counts = {}
+        self.handler_seconds = {}
+        self.handler_histograms = {}
+        self.scheduling_seconds = 0
+        self.statistics_seconds = 0
+        self.fel_sizes = []
+        self.max_fel_size = 0
+        self._next_fel_sample = 0
+
+        fel_pop = simulation.fel.pop
+        def timed_fel_pop():
+            start = time.perf_counter()
+            event = fel_pop()
+            self.scheduling_seconds += time.perf_counter() - start
+            size = len(simulation.fel)
+            self.max_fel_size = max(self.max_fel_size, size)
+            if event.time >= self._next_fel_sample:
+                self.fel_sizes.append((event.time, size))
+                self._next_fel_sample = event.time + self.fel_sample_interval
+            return event
+        simulation.fel.pop = timed_fel_pop
+
+        update_simulation_statistics = simulation.update_simulation_statistics
+        def timed_update_simulation_statistics(event):
+            start = time.perf_counter()
+            update_simulation_statistics(event)
+            self.statistics_seconds += time.perf_counter() - start
+        simulation.update_simulation_statistics = timed_update_simulation_statistics
+
+        simulation.handlers = {event_type: self._timed_handler(handler)
+                               for event_type, handler in simulation.handlers.items()}
+
+    def _timed_handler(self, handler):
+        def timed_handler(event):
+            statistics_seconds = self.statistics_seconds
+            start = time.perf_counter()
+            handler(event)
+            # Handlers update the statistics themselves, that time is counted in statistics_seconds
+            duration = time.perf_counter() - start - (self.statistics_seconds - statistics_seconds)
+
+            name = type(event).__name__
+            if name not in self.event_counts:
+                self.event_counts[name] = 0
+                self.handler_seconds[name] = 0
+                self.handler_histograms[name] = [0] * self.histogram_bins
+            self.event_counts[name] += 1
+            self.handler_seconds[name] += duration
+            # Quarter-octave bins of the duration in nanoseconds
+            bin = int(4 * math.log2(max(duration * 1e9, 1)))
+            self.handler_histograms[name][min(bin, self.histogram_bins - 1)] += 1
+        return timed_handler
+
+    def _percentile(self, histogram, percentile):
+        """
+        Upper edge (in seconds) of the histogram bin holding the given percentile.
+        """
+        threshold = percentile / 100 * sum(histogram)
+        count = 0
+        for bin, bin_count in enumerate(histogram):
+            count += bin_count
+            if count >= threshold:
+                return 2 ** ((bin + 1) / 4) / 1e9
+        return 0
+
+    @staticmethod
+    def _draws(simulation, component):
+        # Arrival streams are consumed through their schedule, which buffers whole batches
+        schedule = getattr(simulation, component, None)
+        if isinstance(schedule, ArrivalSchedule):
+            return schedule.draws()
+        return getattr(simulation.streams, component).draws()
+
+    def summary(self):
+        simulation = self.simulation
+        return {
+            "events": {
+                name: {
+                    "count": count,
+                    "total_seconds": self.handler_seconds[name],
+                    "mean_seconds": self.handler_seconds[name] / count,
+                    "p99_seconds": self._percentile(self.handler_histograms[name], 99),
+                }
+                for name, count in self.event_counts.items()
+            },
+            "scheduling_seconds": self.scheduling_seconds,
+            "statistics_seconds": self.statistics_seconds,
+            "handler_seconds": sum(self.handler_seconds.values()),
+            "fel": {
+                "max_size": self.max_fel_size,
+                "sizes": list(self.fel_sizes),
+            },
+            "random_draws": {component: self._draws(simulation, component)
+                             for component in simulation.streams.components},
+            "interrupts": {
+                "scans": simulation.interrupt_scans,
+                "candidates_scanned": simulation.interrupt_candidates_scanned,
+                "interrupted": simulation.total_interrupts,
+            },
+        }
+
+class EDSimulation():
+    """
+      Object used to represent a single run of the emergency department simulation. All of the
+      state of the run (clock, FEL, resource statuses, queues and statistics) is held on the
+      object, so several simulations can be created and advanced side by side.
+
+      The simulation can be advanced one event at a time with step(), or until a given time
+      with run(). The statistics collected so far are computed with results(). If a
+      statistics_window (in minutes) is given, the time-weighted statistics also keep
+      per-window averages. Random variates are drawn from RandomStreams built from the
+      seed (an int or a SeedSequence); without a seed every run is different. The
+      procedure_mix sets which procedures specialists perform for each triage type and
+      chief complaint (see PROCEDURE_MIX). With an event_pool_size, handled events are
+      recycled for new ones, in which case the event returned by step() is only valid
+      until the next step. The arrival_rates give the hourly walk-in and ambulance
+      dispatch rates (see ARRIVAL_RATES), and max_num_servers and number_of_beds_per_zone
+      set the staffing and bed capacity. With profile, a SimulationProfiler is attached as
+      the profiler attribute. Statistics are only collected after the warmup_time (see
+      output_analysis.detect_warmup to choose it). With antithetic, the random streams
+      hand out complementary uniforms (see
+      output_analysis.run_antithetic_replications).
+    """
+    def __init__(self, seed=None, statistics_window=None, procedure_mix=PROCEDURE_MIX, event_pool_size=0,
+                 arrival_rates=ARRIVAL_RATES, max_num_servers=MAX_NUM_SERVERS,
+                 number_of_beds_per_zone=NUMBER_OF_BEDS_PER_ZONE, profile=False, warmup_time=WARMUP_TIME,
+                 antithetic=False):
+        self.streams = RandomStreams(seed, antithetic)
+        self.walk_in_arrivals = ArrivalSchedule(arrival_rates[1], self.streams.walk_in_arrivals)
+        self.ambulance_dispatches = ArrivalSchedule(arrival_rates[0], self.streams.ambulance_dispatches)
+        self.procedure_mix = procedure_mix
+        self.event_pool = EventPool(event_pool_size)
+        self.handlers = self.event_handlers()
+        self.clock = 0
+        self.prev_event_time = 0
+        self.warmup_time = warmup_time
+        self.next_patient_id = 0
+
+        self.available_ambulances = 10
+        self.diverted_ambulances = 0
+
+        # FEL starts off with an arrival of both ambulance and walk-in at t = 0
+        initial_ambulance_patient = self.new_patient(arrival_type=0)
+        initial_walkin_patient = self.new_patient(arrival_type=1)
+        self.available_ambulances -= 1
+        self.fel = FutureEventList([DepartureAmbulanceEvent(time=0, patient=initial_ambulance_patient), 
+                                    WalkInArrivalEvent(time=0, patient=initial_walkin_patient)])
+
+        # Set number of servers available for each process
+        self.max_num_servers = dict(max_num_servers)
+
+        # Set number of beds available per zone
+        self.bed_capacity_per_zone = dict(number_of_beds_per_zone)
+        self.number_of_beds_per_zone = dict(number_of_beds_per_zone)
+
+        # State Variables - Resource Statuses
+        self.status_workup_doctors = 0
+        self.status_triage_nurses = 0
+        self.status_specialists = 0
+
+        # State Variables - Queues (their lengths are given by the number_*_queue properties)
+        # Lists of the patients interrupted by higher priority patients
+        self.interrupt_lists = {
+            "2":deque(),
+            "3,4,5":deque(),
+        }
+        # List of the patients waiting for beds
+        self.bed_queue_lists = {
+            "1":deque(),
+            "2":deque(),
+            "3,4,5":deque()
+        }
+        # List of the patients in beds waiting for initial workup assessment
+        self.workup_queue_lists = {
+            "1": deque(),
+            "2": deque(),
+            "3,4,5": deque()
+        }
+        # Workup departure events of the patients currently in service, keyed by triage type
+        self.workup_in_service = {
+            1: {},
+            2: {},
+            3: {},
+            4: {},
+            5: {},
+        }
+        #List of the patients in the triage queue
+        self.triage_queue_list = deque()
+        # List of patients waiting to see specialist
+        self.specialist_queue_list = deque()
+
+        ######## Statistics to collect and update ########
+        self.statistics_window = statistics_window
+        self.reset_statistics()
+        ##################################################
+
+        self.profiler = SimulationProfiler(self) if profile else None
+
+    def reset_statistics(self):
+        """
+        Discards the statistics collected so far and starts collecting them afresh from the
+        current clock, e.g. at the end of a warmup or of a batch in a long run. Only the
+        statistics are reset, the state of the ED is left as it is.
+        """
+        statistics_window = self.statistics_window
+        self.statistics_start = self.clock
+        self.total_interrupts = 0
+        self.interrupt_scans = 0
+        self.interrupt_candidates_scanned = 0
+
+        self.total_patients = {
+            "in":0,
+            "out":0,
+        }
+        
+        self.max_queue_lengths = {
+            "Triage": 0,
+            "Bed": 0,
+            "Workup": 0,
+            "Specialist": 0
+        }
+
+        self.time_weighted_queue = {
+            "Triage": TimeWeightedStatistic(statistics_window),
+            "Bed": TimeWeightedStatistic(statistics_window),
+            "Workup": TimeWeightedStatistic(statistics_window),
+            "Specialist": TimeWeightedStatistic(statistics_window),
+        }
+
+        self.server_uptime = {
+            "Triage": TimeWeightedStatistic(statistics_window),
+            "Workup": TimeWeightedStatistic(statistics_window),
+            "Specialist": TimeWeightedStatistic(statistics_window),
+        }
+
+        self.time_in_diversion = TimeWeightedStatistic(statistics_window)
+
+        # Waiting times and lengths of stay of the patients leaving after the warmup, keyed by
+        # measure then by (triage type, arrival type)
+        self.patient_times = {measure: {} for measure in PATIENT_TIME_MEASURES}
+
+    def event_handlers(self):
+        """
+        Returns the handler of every event type.
+        """
+        return {
+            0: self.handle_arrival_event, # Walk In Arrival
+            1: self.handle_arrival_event, # Ambulance Arrival
+            3: self.handle_ambulance_departure_event, # Ambulance Hospital Departure
+            4: self.handle_triage_departure, # Departure from Triage
+            5: self.handle_workup_departure, # Departure from Initial Workup Assessment
+            6: self.handle_specialist_departure, # Departure from Specialist Assessment (i.e. Departure from ED)
+        }
+
+    ################################## SNAPSHOTS AND CHECKPOINTS ##################################
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Instrumentation (profiler, traces) wraps handlers on the instance and is not
+        # part of the simulation state, snapshots always resume uninstrumented
+        for name in ("handlers", "profiler", "update_simulation_statistics"):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.handlers = self.event_handlers()
+        self.profiler = None
+
+    def snapshot(self):
+        """
+        Returns the full state of the simulation (clock, FEL, queues, resource statuses, beds,
+        ambulances, statistics and random streams) as bytes.
+        """
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, seed=None, max_num_servers=None, number_of_beds_per_zone=None):
+        """
+        Creates a simulation resuming from a snapshot. If a seed is given, the simulation
+        continues with fresh random streams built from it, so that several replications can
+        branch from the same state. Staffing and bed capacity can be changed for what-if runs.
+        """
+        simulation = pickle.loads(snapshot)
+        if seed is not None:
+            simulation.reseed(seed)
+        simulation.reconfigure(max_num_servers, number_of_beds_per_zone)
+        return simulation
+
+    def reseed(self, seed):
+        """
+        Replaces the random streams with new ones built from the seed. The arrival streams
+        restart from the arrivals already scheduled in the FEL.
+        """
+        self.streams = RandomStreams(seed, self.streams.antithetic)
+        last_arrival = {0: self.clock, 3: self.clock}
+        for event in self.fel:
+            if event.type in last_arrival:
+                last_arrival[event.type] = max(last_arrival[event.type], event.time)
+        self.walk_in_arrivals = ArrivalSchedule(self.walk_in_arrivals.hourly_rates, self.streams.walk_in_arrivals,
+                                                start=last_arrival[0])
+        self.ambulance_dispatches = ArrivalSchedule(self.ambulance_dispatches.hourly_rates, self.streams.ambulance_dispatches,
+                                                    start=last_arrival[3])
+
+    def reconfigure(self, max_num_servers=None, number_of_beds_per_zone=None):
+        """
+        Changes the staffing and bed capacity of the simulation from now on. Servers already
+        busy finish their service, and no patient is taken into service until the number of
+        busy servers is back under the new maximum; removed beds are taken off the free beds
+        of their zone, which may go negative until enough patients leave it.
+        """
+        if max_num_servers is not None:
+            self.max_num_servers = dict(max_num_servers)
+        if number_of_beds_per_zone is not None:
+            for zone, capacity in number_of_beds_per_zone.items():
+                self.number_of_beds_per_zone[zone] += capacity - self.bed_capacity_per_zone[zone]
+            self.bed_capacity_per_zone = dict(number_of_beds_per_zone)
+
+    def save_checkpoint(self, path):
+        """
+        Writes a snapshot of the simulation to a file (replaced atomically).
+        """
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(self.snapshot())
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load_checkpoint(cls, path, seed=None):
+        with open(path, "rb") as file:
+            return cls.from_snapshot(file.read(), seed=seed)
+
+    ###################################################################################################
+
+    def new_patient(self, arrival_type):
+        """
+        Creates a patient with the next patient id of this simulation.
+        """
+        self.next_patient_id += 1
+        return Patient(arrival_type=arrival_type, patient_id=self.next_patient_id - 1)
+
+    @property
+    def number_triage_queue(self):
+        return len(self.triage_queue_list)
+
+    @property
+    def number_waiting_for_bed_queue(self):
+        bed_queue_lists = self.bed_queue_lists
+        return len(bed_queue_lists["1"]) + len(bed_queue_lists["2"]) + len(bed_queue_lists["3,4,5"])
+
+    @property
+    def number_workup_queue(self):
+        workup_queue_lists = self.workup_queue_lists
+        return len(workup_queue_lists["1"]) + len(workup_queue_lists["2"]) + len(workup_queue_lists["3,4,5"])
+
+    @property
+    def number_specialist_queue(self):
+        return len(self.specialist_queue_list)
+
+    def check_bed_queue(self, zone, patient):
+        """
+        Helper method used to remove patients waiting for a bed from the queue when another
+        patient exits the system (i.e., freeing up a bed).
+
+        Depending on the zone, first check if there is a queued patient that can go into that zone.
+        If there is an applicable patient, assign them to the zone and generate their departure
+        event for intial workup.
+        """
+        bed_queue_lists = self.bed_queue_lists
+        if zone in {3,4}:
+            # Zone 3 or 4 only serves patients of type 2,3,4,5 
+            if len(bed_queue_lists["2"]) > 0:
+                self.give_bed_queued_patient(bed_queue_lists["2"].pop(), zone, "2")
+
+            elif len(bed_queue_lists["3,4,5"]) > 0:
+                self.give_bed_queued_patient(bed_queue_lists["3,4,5"].pop(), zone, "3,4,5")
+
+        elif zone in {2}:
+            # Zone 2 only serves patients of type 1,2
+            if len(bed_queue_lists["1"]) > 0:
+                self.give_bed_queued_patient(bed_queue_lists["1"].pop(), zone, "1")
+
+            elif len(bed_queue_lists["2"]) > 0:
+                self.give_bed_queued_patient(bed_queue_lists["2"].pop(), zone, "2")
+
+        else:
+            # Zone 1 only serves patients of type 1
+            if len(bed_queue_lists["1"]) > 0:
+                self.give_bed_queued_patient(bed_queue_lists["1"].pop(), zone, "1")
+        return
+
+    def give_bed_queued_patient(self, patient: Patient, zone, triage_type):
+        """
+        Helper method used to place a patient taken off the bed queue into a zone, and either
+        queue them for initial workup or generate their workup departure event.
+        """
+        self.number_of_beds_per_zone[zone] -= 1 # The freed bed is taken by the queued patient
+        patient.bed_time = self.clock
+
+        patient.assign_bed_in_zone(zone)
+        if self.status_workup_doctors >= self.max_num_servers["doctors"]:
+            self.workup_queue_lists[triage_type].append(patient)
+        else:
+            self.status_workup_doctors += 1
+            workup_service_time = generate_workup_service_time(patient, self.streams.workup_times)
+            self.schedule_workup_departure(patient, workup_service_time)
+        return
+
+    def assign_type_3_4_5_patient_to_zone(self, patient: Patient, zone):
+        """
+        Helper method used to assign patients of type 3, 4, or 5 to a zone in the ED. There
+        is no priority interrupting between these types of patients.
+        """
+        self.number_of_beds_per_zone[zone] -= 1 # Decrease number of available beds
+        patient.bed_time = self.clock
+
+        patient.assign_bed_in_zone(zone)
+        if self.status_workup_doctors >= self.max_num_servers["doctors"]: # Check for available doctors
+            self.workup_queue_lists["3,4,5"].append(patient)
+        else:
+            self.status_workup_doctors += 1
+            patient.assign_bed_in_zone(zone)
+            workup_service_time = generate_workup_service_time(patient, self.streams.workup_times)
+            self.schedule_workup_departure(patient, workup_service_time)
+        return
+
+    def assign_type_1_2_patient_to_zone(self, patient: Patient, zone):
+        """
+        Helper method used to assign patients of type 1 or 2 to a zone in the ED. These patients
+        can interrupt other patients of lower priority in service, but cannot interrupt their own
+        priority type.
+        """
+        self.number_of_beds_per_zone[zone] -= 1
+        patient.bed_time = self.clock
+        patient.assign_bed_in_zone(zone)
+        workup_service_time = generate_workup_service_time(patient, self.streams.workup_times)
+        if self.status_workup_doctors >= self.max_num_servers["doctors"]:
             # If all doctors are busy, attempt to interrupt lower priority patient
-            isInterrupted = patient_interrupt(patient, workup_service_time, clock)
+            isInterrupted = self.patient_interrupt(patient, workup_service_time)
             if isInterrupted:
-                total_interrupts += 1
+                self.total_interrupts += 1
                 patient.assign_bed_in_zone(zone)
-                fel.append(DepartureWorkupEvent(patient = patient, time = clock + workup_service_time))    
-         else:
-            status_workup_doctors += 1
+                self.schedule_workup_departure(patient, workup_service_time)
+        else:
+            self.status_workup_doctors += 1
             patient.assign_bed_in_zone(zone)
-            fel.append(DepartureWorkupEvent(patient = patient, time = clock + workup_service_time))    
-         return
-
-      def patient_interrupt(patient: Patient, workup_service_time, clock):
-         """
-         Helper method used by type 1 and 2 patients to find and interrupt patients of lower
-         priority (i.e. greater number triage type).
-
-         If there are no patients of lower priority, the pateint gets add to the workup queue.
-         """
-         global number_workup_queue
-
-         event_to_interrupt = None
-         for index, event in enumerate(fel):
-              # Only attempt to interrupt DepartureWorkupEvents (type 1)
-              if event.type == 5 and event.patient.triage_type < patient.triage_type:
-                  interrupted_patient = event.patient
-                  if interrupted_patient.triage_type == 2:
-                     interrupt_lists["2"].append(interrupted_patient)
-                  else: 
-                     interrupt_lists["3,4,5"].append(interrupted_patient)
-                  event_to_interrupt = index
-                  # fel.append(DepartureWorkupEvent(patient=patient, time = clock + workup_service_time))
-                  break
-         if event_to_interrupt:
-            fel.pop(event_to_interrupt)
-         else:
+            self.schedule_workup_departure(patient, workup_service_time)
+        return
+
+    def patient_interrupt(self, patient: Patient, workup_service_time):
+        """
+        Helper method used by type 1 and 2 patients to find and interrupt patients of lower
+        priority (i.e. greater number triage type).
+
+        If there are no patients of lower priority, the pateint gets add to the workup queue.
+        """
+        self.interrupt_scans += 1
+        event_to_interrupt = None
+        for triage_type in range(1, patient.triage_type):
+            # Only DepartureWorkupEvents in service are candidates, take the one due first
+            self.interrupt_candidates_scanned += len(self.workup_in_service[triage_type])
+            for event in self.workup_in_service[triage_type]:
+                if event_to_interrupt is None or event.time < event_to_interrupt.time:
+                    event_to_interrupt = event
+
+        if event_to_interrupt is None:
             # Can only be a type 1 or 2 patient that failed to interrupt
-            workup_queue_lists[str(patient.triage_type)].append(patient)
-            number_workup_queue += 1
-         return True if event_to_interrupt else False
-      ###################################################################################################
-
-      # Generate next arrival event
-      arrival_type = event.patient.arrival_type
-      
-      a = generate_interarrival_time(clock, arrival_type)
-
-      if arrival_type == 0: # Ambulance arrival
-         available_ambulances += 1
-         if (event.diverted_ambulance): # If diverted, ambulance arrives with no patient
-            diverted_ambulances -= 1
-            update_simulation_statistics(event)
-            return
-      else:
-          # Generate next walk-in arrival event
-          fel.append(WalkInArrivalEvent(time=clock + a, patient=Patient(arrival_type=arrival_type)))
-
-      patient = event.patient
-      if (arrival_type == 0):
-         if patient.triage_type == 3 or patient.triage_type == 4:
-            if number_of_beds_per_zone[3] > 0:
-               assign_type_3_4_5_patient_to_zone(patient, 3)
-            elif number_of_beds_per_zone[4] > 0:
-               assign_type_3_4_5_patient_to_zone(patient, 4)
+            self.workup_queue_lists[str(patient.triage_type)].append(patient)
+            return False
+
+        interrupted_patient = event_to_interrupt.patient
+        if interrupted_patient.triage_type == 2:
+            self.interrupt_lists["2"].append(interrupted_patient)
+        else: 
+            self.interrupt_lists["3,4,5"].append(interrupted_patient)
+        del self.workup_in_service[interrupted_patient.triage_type][event_to_interrupt]
+        self.fel.cancel(event_to_interrupt)
+        return True
+
+    def schedule_workup_departure(self, patient: Patient, workup_service_time):
+        """
+        Helper method used to generate a workup departure event and record it as in service,
+        so that it can be found directly if the patient gets interrupted.
+        """
+        if patient.workup_start is None: # Resuming interrupted patients keep their first start
+            patient.workup_start = self.clock
+        event = self.event_pool.acquire(DepartureWorkupEvent, patient=patient, time=self.clock + workup_service_time)
+        self.workup_in_service[patient.triage_type][event] = None
+        self.fel.append(event)
+        return
+
+    def handle_arrival_event(self, event):
+        """
+           Method used to handles patient arrival events. Handling varies depending on arrival type 
+           (ambulance or walk-in). Triage type (1-5) is pre-determined for ambulance arrivals and walk-in 
+           patients must get serviced by triage nurses to determine their triage priority.
+           
+           Triage types 1 and 2 only occur as ambulance arrivals and type 5 only occur as walk-in patients.
+
+           To establish a process for priority, patients types 1 and 2 are capable of interrupting types 
+           lower than them, where they will seize the doctor currently serving another patient.
+        """
+        # Generate next arrival event
+        arrival_type = event.patient.arrival_type
+
+        if arrival_type == 0: # Ambulance arrival
+            self.available_ambulances += 1
+            if (event.diverted_ambulance): # If diverted, ambulance arrives with no patient
+                self.diverted_ambulances -= 1
+                self.update_simulation_statistics(event)
+                return
+        else:
+            # Generate next walk-in arrival event
+            self.fel.append(self.event_pool.acquire(WalkInArrivalEvent, time=self.walk_in_arrivals.next_arrival(), patient=self.new_patient(arrival_type)))
+        patient = event.patient
+        patient.arrival_time = self.clock
+        number_of_beds_per_zone = self.number_of_beds_per_zone
+        if (arrival_type == 0):
+            if patient.triage_type == 3 or patient.triage_type == 4:
+                if number_of_beds_per_zone[3] > 0:
+                    self.assign_type_3_4_5_patient_to_zone(patient, 3)
+                elif number_of_beds_per_zone[4] > 0:
+                    self.assign_type_3_4_5_patient_to_zone(patient, 4)
+                else:
+                    self.bed_queue_lists["3,4,5"].append(patient)
+
+            elif patient.triage_type == 2:
+                if number_of_beds_per_zone[2] > 0:
+                    self.assign_type_1_2_patient_to_zone(patient, 2)
+                elif number_of_beds_per_zone[3] > 0:
+                    self.assign_type_1_2_patient_to_zone(patient, 3)
+                elif number_of_beds_per_zone[4] > 0:
+                    self.assign_type_1_2_patient_to_zone(patient, 4)
+                else:
+                    self.bed_queue_lists["2"].append(patient)
+
+            else: # Patient type 1
+                if number_of_beds_per_zone[1] > 0:
+                    self.assign_type_1_2_patient_to_zone(patient, 1)
+                elif number_of_beds_per_zone[2] > 0:
+                    self.assign_type_1_2_patient_to_zone(patient, 2)
+                else:
+                    self.bed_queue_lists["1"].append(patient)
+
+        else: # Walk-in patient arrives, patient goes to triage first
+            if self.status_triage_nurses >= self.max_num_servers["nurses"]:
+                self.triage_queue_list.append(patient)
             else:
-               number_waiting_for_bed_queue += 1
-               bed_queue_lists["3,4,5"].append(patient)
-
-         elif patient.triage_type == 2:
-               if number_of_beds_per_zone[2] > 0:
-                  assign_type_1_2_patient_to_zone(patient, 2)
-               elif number_of_beds_per_zone[3] > 0:
-                  assign_type_1_2_patient_to_zone(patient, 3)
-               elif number_of_beds_per_zone[4] > 0:
-                  assign_type_1_2_patient_to_zone(patient, 4)
-               else:
-                  number_waiting_for_bed_queue += 1
-                  bed_queue_lists["2"].append(patient)
-
-         else: # Patient type 1
-               if number_of_beds_per_zone[1] > 0:
-                  assign_type_1_2_patient_to_zone(patient, 1)
-               elif number_of_beds_per_zone[2] > 0:
-                  assign_type_1_2_patient_to_zone(patient, 2)
-               else:
-                  number_waiting_for_bed_queue += 1
-                  bed_queue_lists["1"].append(patient)
-
-      else: # Walk-in patient arrives, patient goes to triage first
-          if status_triage_nurses == max_num_servers["nurses"]:
-              number_triage_queue += 1
-              triage_queue_list.append(patient)
-          else:
-              status_triage_nurses += 1
-              patient.assign_triage_type(triage_type=generate_walk_in_triage_type())
-              triage_time = generate_triage_time(patient) 
-              fel.append(DepartureTriageEvent(patient=patient, time=clock+triage_time))
-
-      total_patients["in"] += 1       
-      update_simulation_statistics(event)
-      return
-
-   def handle_ambulance_departure_event(event: DepartureAmbulanceEvent):
-       """
-       Method used to handle ambulance departure event to go and assess patient. If there are available 
-       ambulances, the patient will be assigned to one. If the triage type is 1 or 2, patients will go to 
-       the hospital no matter what. if the triage type is 3 or 4, patients will go to the hospital if there is 
-       less than 5 other patients waiting in queue for a bed; otherwise, the ambulance will get diverted to another
-       hospital.
-       """
-       global available_ambulances
-       global diverted_ambulances
-
-       a = generate_interarrival_time(clock, 0)
-       fel.append(DepartureAmbulanceEvent(time=clock + a, patient=Patient(arrival_type=0)))
-
-       travel_time = np.random.triangular(5, 10, 20, 1)[0]
-       process_time = np.random.uniform(4, 10)
-       triage_type = generate_ambulance_arrival_triage_type()
-
-       event.patient.assign_triage_type(triage_type=triage_type)
-       if (available_ambulances > 0):
-            available_ambulances -= 1
-            if ((triage_type in {1,2}) or (number_waiting_for_bed_queue < 5 and triage_type in {3,4})):
-               fel.append(AmbulanceHospitalArrivalEvent(time=clock + travel_time*2 + process_time, patient=event.patient))
+                self.status_triage_nurses += 1
+                patient.triage_start = self.clock
+                patient.assign_triage_type(generate_walk_in_triage_type(self.streams.triage_types), self.streams.triage_types)
+                triage_time = generate_triage_time(patient, self.streams.triage_times) 
+                self.fel.append(self.event_pool.acquire(DepartureTriageEvent, patient=patient, time=self.clock+triage_time))
+        self.total_patients["in"] += 1       
+        self.update_simulation_statistics(event)
+        return
+
+    def handle_ambulance_departure_event(self, event: DepartureAmbulanceEvent):
+        """
+        Method used to handle ambulance departure event to go and assess patient. If there are available 
+        ambulances, the patient will be assigned to one. If the triage type is 1 or 2, patients will go to 
+        the hospital no matter what. if the triage type is 3 or 4, patients will go to the hospital if there is 
+        less than 5 other patients waiting in queue for a bed; otherwise, the ambulance will get diverted to another
+        hospital.
+        """
+        clock = self.clock
+        self.fel.append(self.event_pool.acquire(DepartureAmbulanceEvent, time=self.ambulance_dispatches.next_arrival(), patient=self.new_patient(0)))
+        travel_time = self.streams.ambulance_travel.triangular(5, 10, 20)
+        process_time = self.streams.ambulance_travel.uniform(4, 10)
+        triage_type = generate_ambulance_arrival_triage_type(self.streams.triage_types)
+
+        event.patient.assign_triage_type(triage_type, self.streams.triage_types)
+        if (self.available_ambulances > 0):
+            self.available_ambulances -= 1
+            if ((triage_type in {1,2}) or (self.number_waiting_for_bed_queue < 5 and triage_type in {3,4})):
+                self.fel.append(self.event_pool.acquire(AmbulanceHospitalArrivalEvent, time=clock + travel_time*2 + process_time, patient=event.patient))
             else:
-               diverted_ambulances += 1
-               diverted_travel_time = np.random.triangular(10, 15, 25, 1)[0]
-               fel.append(AmbulanceHospitalArrivalEvent(time=clock+travel_time+process_time+diverted_travel_time, patient=event.patient, diverted_ambulance=True))
-       update_simulation_statistics(event)
-       return
-
-   def handle_triage_departure(event: DepartureTriageEvent):
-      """
-      Method used to handle a walk-in patient's departure from triage. Uses similar methods as arrival 
-      eventsusing the following logic: If a bed is free, assign patient to it; otherwise append to a 
-      queue waiting for bed.
-      """
-      global number_waiting_for_bed_queue
-      global number_triage_queue
-      global status_triage_nurses
-      
-      status_triage_nurses -= 1
-      if number_of_beds_per_zone[4] > 0:
-          assign_type_3_4_5_patient_to_zone(event.patient, 4)
-      elif number_of_beds_per_zone[3] > 0:
-          assign_type_3_4_5_patient_to_zone(event.patient, 3)
-      else:
-          number_waiting_for_bed_queue += 1
-          bed_queue_lists["3,4,5"].append(event.patient)
-   
-      if len(triage_queue_list) != 0:
-          patient = triage_queue_list.pop(0)
-          number_triage_queue -= 1
-          status_triage_nurses += 1
-          patient.assign_triage_type(triage_type=generate_walk_in_triage_type())
-          triage_time = generate_triage_time(patient)  
-          fel.append(DepartureTriageEvent(patient=patient, time=clock+triage_time))
-
-      update_simulation_statistics(event)
-      return
-
-   def handle_workup_departure(event: DepartureWorkupEvent):
-      """
-      Method used to handle a departure from the initial workup event. The first step 
-      is to check for previously interrupted lower priority patients and re-generate their
-      workup departure event. If there are none, then check for queued workup patients and
-      generate their workup departure events.
-
-      Patients will then be sent to a specialist where they will receive tailored treatment/tests.
-      """
-      global status_workup_doctors
-      global number_workup_queue
-      ############################# WORKUP DEPARTURE EVENT HELPER METHODS ################################
-      def service_waiting_patient(list: list): 
-         """
-         Helper method used to generate a departure event for an interrupted or queued patient.
-         """
-         global status_workup_doctors
-         
-         patient = list.pop(0)
-         status_workup_doctors += 1
-         workup_service_time = generate_workup_service_time(patient=patient)
-         fel.append(DepartureWorkupEvent(patient=patient, time = clock + workup_service_time))
-         return
-
-      def handle_specialist_event(patient):
-         """
-         Helper method used to generate a specialist departure event
-         """
-         global status_specialists
-         global number_specialist_queue
-
-         if status_specialists == max_num_servers["specialists"]:
-             number_specialist_queue += 1
-             specialist_queue_list.append(patient)
-         else:
-             status_specialists += 1
-             specialist_service_time = generate_procedure_time(patient)
-             fel.append(DepartureSpecialistEvent(patient = patient, time = clock + specialist_service_time))
-         return
-      ###################################################################################################
+                self.diverted_ambulances += 1
+                diverted_travel_time = self.streams.ambulance_travel.triangular(10, 15, 25)
+                self.fel.append(self.event_pool.acquire(AmbulanceHospitalArrivalEvent, time=clock+travel_time+process_time+diverted_travel_time, patient=event.patient, diverted_ambulance=True))
+        self.update_simulation_statistics(event)
+        return
+
+    def handle_triage_departure(self, event: DepartureTriageEvent):
+        """
+        Method used to handle a walk-in patient's departure from triage. Uses similar methods as arrival 
+        eventsusing the following logic: If a bed is free, assign patient to it; otherwise append to a 
+        queue waiting for bed.
+        """
+        self.status_triage_nurses -= 1
+        event.patient.triage_end = self.clock
+        if self.number_of_beds_per_zone[4] > 0:
+            self.assign_type_3_4_5_patient_to_zone(event.patient, 4)
+        elif self.number_of_beds_per_zone[3] > 0:
+            self.assign_type_3_4_5_patient_to_zone(event.patient, 3)
+        else:
+            self.bed_queue_lists["3,4,5"].append(event.patient)
      
-      status_workup_doctors -= 1
-
-      # Check for any interrupted patients and generature departure event if applicable
-      if len(interrupt_lists["2"]) != 0:
-         service_waiting_patient(interrupt_lists["2"])
-      elif len(interrupt_lists["3,4,5"]) != 0:
-         service_waiting_patient(interrupt_lists["3,4,5"])  
-
-      # If there is a doctor still idle, check for queued patient and generate departure event if applicable
-      if status_workup_doctors < max_num_servers["doctors"]:
-          if len(workup_queue_lists["1"]) != 0:
-            service_waiting_patient(workup_queue_lists["1"])
-            number_workup_queue -= 1
-          elif len(workup_queue_lists["2"]) != 0:
-            service_waiting_patient(workup_queue_lists["2"])
-            number_workup_queue -= 1
-          elif len(workup_queue_lists["3,4,5"]) != 0:
-            service_waiting_patient(workup_queue_lists["3,4,5"])
-            number_workup_queue -= 1
-      
-      handle_specialist_event(event.patient)
-      update_simulation_statistics(event)
-      return
-
-   def handle_specialist_departure(event: DepartureSpecialistEvent):
-      """
-      Method used to handle a patient's departure from the specialist assessment
-      event. This involves freeing up the status of a specialist and the bed in the
-      zone of the current patient. 
-      
-      If there is a patient in the specialist queue, a specialist departure event is 
-      created for that patient.
-      """
-      global status_specialists
-      global number_specialist_queue
-      
-      status_specialists -= 1
-      # Check to see if there is a patient in the specialist queue
-      if number_specialist_queue > 0:
-          status_specialists += 1
-          number_specialist_queue -= 1
-          queued_patient = specialist_queue_list.pop(0)
-          specialist_service_time = generate_procedure_time(event.patient)
-          
-          # Generate a departure event for the queued patient
-          fel.append(DepartureSpecialistEvent(patient = queued_patient, time = clock + specialist_service_time))
-      
-      # Free up one bed from the zone of the departing patient
-      total_patients["out"] += 1
-      number_of_beds_per_zone[event.patient.zone] += 1
-
-      check_bed_queue(event.patient.zone, event.patient)
-
-      update_simulation_statistics(event)
-      return
-
-   def update_simulation_statistics(event):
-       """
-       Method used to update counters and calculate statistics called after each event.
-       """
-       delta_t = event.time - prev_event_time
-       if (event.time > 20160):
-         # Average queue length
-         time_weighted_queue["Triage"].append(delta_t * number_triage_queue)
-         time_weighted_queue["Bed"].append(delta_t * number_waiting_for_bed_queue)
-         time_weighted_queue["Workup"].append(delta_t * number_workup_queue)
-         time_weighted_queue["Specialist"].append(delta_t * number_specialist_queue)
-
-         # Diverted Ambulance
-         time_in_diversion.append(delta_t * diverted_ambulances)
-         
-         # Maximum queue length
-         max_queue_lengths["Triage"] = max(max_queue_lengths["Triage"], number_triage_queue)
-         max_queue_lengths["Bed"] = max(max_queue_lengths["Bed"], number_waiting_for_bed_queue)
-         max_queue_lengths["Workup"] = max(max_queue_lengths["Triage"], number_workup_queue)
-         max_queue_lengths["Specialist"] = max(max_queue_lengths["Triage"], number_specialist_queue)
-      
-         # Server uptime
-         server_uptime["Triage"].append(delta_t * status_triage_nurses)
-         server_uptime["Workup"].append(delta_t * status_workup_doctors)
-         server_uptime["Specialist"].append(delta_t * status_specialists)
-
-       return
-
-   while clock <= simulation_time:
-      event = fel.pop(0)
-      prev_event_time = clock
-      clock = event.time
+        # Staffing may have been cut below the number of busy nurses (see reconfigure)
+        if self.triage_queue_list and self.status_triage_nurses < self.max_num_servers["nurses"]:
+            patient = self.triage_queue_list.popleft()
+            self.status_triage_nurses += 1
+            patient.triage_start = self.clock
+            patient.assign_triage_type(generate_walk_in_triage_type(self.streams.triage_types), self.streams.triage_types)
+            triage_time = generate_triage_time(patient, self.streams.triage_times)  
+            self.fel.append(self.event_pool.acquire(DepartureTriageEvent, patient=patient, time=self.clock+triage_time))
+        self.update_simulation_statistics(event)
+        return
+
+    def service_waiting_patient(self, list: deque): 
+        """
+        Helper method used to generate a departure event for an interrupted or queued patient.
+        """
+        patient = list.popleft()
+        self.status_workup_doctors += 1
+        workup_service_time = generate_workup_service_time(patient, self.streams.workup_times)
+        self.schedule_workup_departure(patient, workup_service_time)
+        return
+
+    def handle_specialist_event(self, patient):
+        """
+        Helper method used to generate a specialist departure event
+        """
+        if self.status_specialists >= self.max_num_servers["specialists"]:
+            self.specialist_queue_list.append(patient)
+        else:
+            self.status_specialists += 1
+            patient.specialist_start = self.clock
+            specialist_service_time = generate_procedure_time(patient, self.streams.procedures, self.procedure_mix)
+            self.fel.append(self.event_pool.acquire(DepartureSpecialistEvent, patient = patient, time = self.clock + specialist_service_time))
+        return
+
+    def handle_workup_departure(self, event: DepartureWorkupEvent):
+        """
+        Method used to handle a departure from the initial workup event. The first step 
+        is to check for previously interrupted lower priority patients and re-generate their
+        workup departure event. If there are none, then check for queued workup patients and
+        generate their workup departure events.
+
+        Patients will then be sent to a specialist where they will receive tailored treatment/tests.
+        """
+        self.status_workup_doctors -= 1
+        del self.workup_in_service[event.patient.triage_type][event]
+        event.patient.workup_end = self.clock
+
+        # Check for any interrupted patients and generature departure event if applicable
+        if self.status_workup_doctors < self.max_num_servers["doctors"]:
+            if len(self.interrupt_lists["2"]) != 0:
+                self.service_waiting_patient(self.interrupt_lists["2"])
+            elif len(self.interrupt_lists["3,4,5"]) != 0:
+                self.service_waiting_patient(self.interrupt_lists["3,4,5"])
+
+        # If there is a doctor still idle, check for queued patient and generate departure event if applicable
+        if self.status_workup_doctors < self.max_num_servers["doctors"]:
+            workup_queue_lists = self.workup_queue_lists
+            if len(workup_queue_lists["1"]) != 0:
+                self.service_waiting_patient(workup_queue_lists["1"])
+            elif len(workup_queue_lists["2"]) != 0:
+                self.service_waiting_patient(workup_queue_lists["2"])
+            elif len(workup_queue_lists["3,4,5"]) != 0:
+                self.service_waiting_patient(workup_queue_lists["3,4,5"])
+        
+        self.handle_specialist_event(event.patient)
+        self.update_simulation_statistics(event)
+        return
+
+    def handle_specialist_departure(self, event: DepartureSpecialistEvent):
+        """
+        Method used to handle a patient's departure from the specialist assessment
+        event. This involves freeing up the status of a specialist and the bed in the
+        zone of the current patient. 
+        
+        If there is a patient in the specialist queue, a specialist departure event is 
+        created for that patient.
+        """
+        self.status_specialists -= 1
+        # Check to see if there is a patient in the specialist queue
+        if self.specialist_queue_list and self.status_specialists < self.max_num_servers["specialists"]:
+            self.status_specialists += 1
+            queued_patient = self.specialist_queue_list.popleft()
+            queued_patient.specialist_start = self.clock
+            specialist_service_time = generate_procedure_time(event.patient, self.streams.procedures, self.procedure_mix)
             
-      if event.type == 0 or event.type == 1: # Walk In or Ambulance Arrival
-         handle_arrival_event(event)
-      elif event.type == 3: # Ambulance Hospital Departure
-          handle_ambulance_departure_event(event)
-      elif event.type == 4: # Departure from Triage
-         handle_triage_departure(event)
-      elif event.type == 5: # Departure from Initial Workup Assessment
-         handle_workup_departure(event)
-      else: # Departure from Specialist Assessment (i.e. Departure from ED)
-         handle_specialist_departure(event)
-      
-      fel.sort(key=lambda x: x.time, reverse = False)
-   
-   # print("\nNumber of doctors: ", max_num_servers["doctors"])
-   # print("Number of triage nurses: ", max_num_servers["nurses"])
-   # print("Number of specialists: ", max_num_servers["specialists"], "\n")
-
-   # End of Simulation - Statistic Calculations
-   time_weighted_average_queues = {
-      "Triage": sum(time_weighted_queue['Triage'])/clock,
-      "Bed": sum(time_weighted_queue['Bed'])/clock,
-      "Workup": sum(time_weighted_queue["Workup"])/clock,
-      "Specialist": sum(time_weighted_queue["Specialist"])/clock
-   }
-
-   average_queue_time_per_customer = {
-       "Triage": sum(time_weighted_queue['Triage'])/total_patients["out"],
-       "Bed": sum(time_weighted_queue['Bed'])/total_patients["out"],
-       "Workup": sum(time_weighted_queue["Workup"])/total_patients["out"],
-       "Specialist": sum(time_weighted_queue["Specialist"])/total_patients["out"]    
-   }
-
-   total_server_uptime = {
-       'Triage': sum(server_uptime['Triage']),
-       'Workup': sum(server_uptime['Workup']),
-       'Specialist': sum(server_uptime['Specialist'])
-   }
-
-   server_utilization_rate = {
-       'Triage': (sum(server_uptime['Triage'])/(max_num_servers['nurses'] * clock)) * 100,
-       'Workup': (sum(server_uptime['Workup'])/(max_num_servers['doctors'] * clock)) * 100,
-       'Specialist': (sum(server_uptime['Specialist'])/(max_num_servers['specialists'] * clock)) * 100
-   }
-
-   server_idle_rate = {
-       'Triage': (1 - (sum(server_uptime['Triage'])/(max_num_servers['nurses'] * clock))) * 100,
-       'Workup': (1 - (sum(server_uptime['Workup'])/(max_num_servers['doctors'] * clock))) * 100,
-       'Specialist': (1 - (sum(server_uptime['Specialist'])/(max_num_servers['specialists'] * clock))) * 100
-   }
-
-   time_percentage_of_ambulances_in_diversion = sum(time_in_diversion)/(10 * clock) * 100
-
-   return {'Time Weighted Average Queues':time_weighted_average_queues, 
-           'Average Queue Time Per Customer': average_queue_time_per_customer, 
-           'Max Queue Lengths': max_queue_lengths,
-           'Total Server Uptime': total_server_uptime,
-           'Server Utilization Rate': server_utilization_rate,
-           'Server Idle Rate': server_idle_rate,
-           'Percentage of Time Ambulances Spent in Diversion': {'Ambulance Diversion':time_percentage_of_ambulances_in_diversion}}
-
-def main():
-   number_of_replications = 10
-   simulation_time = 24 * 60 * 180
-   accumulated_results = []
-
-   for i in range(number_of_replications):
-      sim_results = emergency_department_simulation(simulation_time)
-      accumulated_results.append(sim_results)
-
-    # Calculate average across all simulations
+            # Generate a departure event for the queued patient
+            self.fel.append(self.event_pool.acquire(DepartureSpecialistEvent, patient = queued_patient, time = self.clock + specialist_service_time))
+        # Free up one bed from the zone of the departing patient
+        self.total_patients["out"] += 1
+        event.patient.departure_time = self.clock
+        if self.clock > self.warmup_time:
+            self.record_patient_times(event.patient)
+        self.number_of_beds_per_zone[event.patient.zone] += 1
+
+        # The zone may still be over capacity if beds were removed (see reconfigure)
+        if self.number_of_beds_per_zone[event.patient.zone] > 0:
+            self.check_bed_queue(event.patient.zone, event.patient)
+
+        self.update_simulation_statistics(event)
+        return
+
+    def record_patient_times(self, patient: Patient):
+        """
+        Helper method used to add the stage times of a departing patient to the quantile
+        sketches of their triage type and arrival type.
+        """
+        group = (patient.triage_type, patient.arrival_type)
+        for measure, (start, end) in PATIENT_TIME_MEASURES.items():
+            if start == "ready_for_bed": # Walk-ins need a bed once triaged, ambulance patients on arrival
+                start_time = patient.arrival_time if patient.triage_end is None else patient.triage_end
+            else:
+                start_time = getattr(patient, start)
+            end_time = getattr(patient, end)
+            if start_time is None or end_time is None:
+                continue
+            sketches = self.patient_times[measure]
+            if group not in sketches:
+                sketches[group] = QuantileSketch()
+            sketches[group].add(end_time - start_time)
+
+    def update_simulation_statistics(self, event):
+        """
+        Method used to update counters and calculate statistics called after each event.
+        """
+        start = max(self.prev_event_time, self.statistics_start)
+        if (event.time > self.warmup_time):
+            time_weighted_queue = self.time_weighted_queue
+            max_queue_lengths = self.max_queue_lengths
+            server_uptime = self.server_uptime
+
+            # Average queue length
+            time_weighted_queue["Triage"].record(self.number_triage_queue, start, event.time)
+            time_weighted_queue["Bed"].record(self.number_waiting_for_bed_queue, start, event.time)
+            time_weighted_queue["Workup"].record(self.number_workup_queue, start, event.time)
+            time_weighted_queue["Specialist"].record(self.number_specialist_queue, start, event.time)
+
+            # Diverted Ambulance
+            self.time_in_diversion.record(self.diverted_ambulances, start, event.time)
+            
+            # Maximum queue length
+            max_queue_lengths["Triage"] = max(max_queue_lengths["Triage"], self.number_triage_queue)
+            max_queue_lengths["Bed"] = max(max_queue_lengths["Bed"], self.number_waiting_for_bed_queue)
+            max_queue_lengths["Workup"] = max(max_queue_lengths["Triage"], self.number_workup_queue)
+            max_queue_lengths["Specialist"] = max(max_queue_lengths["Triage"], self.number_specialist_queue)
+        
+            # Server uptime
+            server_uptime["Triage"].record(self.status_triage_nurses, start, event.time)
+            server_uptime["Workup"].record(self.status_workup_doctors, start, event.time)
+            server_uptime["Specialist"].record(self.status_specialists, start, event.time)
+
+        return
+
+    def step(self):
+        """
+        Processes the next event in the FEL and returns it.
+        """
+        event = self.fel.pop()
+        self.prev_event_time = self.clock
+        self.clock = event.time
+        if self.statistics_start < self.warmup_time < self.clock:
+            # The warmup ends with this event, statistics are collected from the warmup time on
+            self.reset_statistics()
+            self.statistics_start = self.warmup_time
+              
+        self.handlers[event.type](event)
+
+        self.event_pool.release(event)
+        return event
+
+    def run(self, until, checkpoint_path=None, checkpoint_interval=24 * 60):
+        """
+        Processes events until the clock passes the given time, then returns the results.
+
+        With a checkpoint_path, a checkpoint is saved every checkpoint_interval minutes of
+        simulated time, so an interrupted run can be resumed with load_checkpoint().
+        """
+        if checkpoint_path is None:
+            while self.clock <= until:
+                self.step()
+            return self.results()
+
+        while self.clock <= until:
+            next_checkpoint = self.clock + checkpoint_interval
+            while self.clock <= min(until, next_checkpoint):
+                self.step()
+            self.save_checkpoint(checkpoint_path)
+        return self.results()
+
+    def warm_up(self, warmup_time=None):
+        """
+        Processes events up to the end of the warmup period and returns a snapshot, from
+        which replications can resume without simulating the warmup again.
+        """
+        warmup_time = self.warmup_time if warmup_time is None else warmup_time
+        while self.clock <= warmup_time:
+            self.step()
+        return self.snapshot()
+
+    def results(self):
+        """
+        Calculates the statistics of the simulation up to the current clock, over the time
+        since the statistics were last reset (the end of the warmup by default).
+        """
+        clock = self.clock - self.statistics_start # Time over which the statistics were collected
+        time_weighted_queue = self.time_weighted_queue
+        server_uptime = self.server_uptime
+        total_patients = self.total_patients
+        max_num_servers = self.max_num_servers
+
+        time_weighted_average_queues = {
+           "Triage": time_weighted_queue['Triage'].area/clock,
+           "Bed": time_weighted_queue['Bed'].area/clock,
+           "Workup": time_weighted_queue["Workup"].area/clock,
+           "Specialist": time_weighted_queue["Specialist"].area/clock
+        }
+
+        average_queue_time_per_customer = {
+            "Triage": time_weighted_queue['Triage'].area/total_patients["out"],
+            "Bed": time_weighted_queue['Bed'].area/total_patients["out"],
+            "Workup": time_weighted_queue["Workup"].area/total_patients["out"],
+            "Specialist": time_weighted_queue["Specialist"].area/total_patients["out"]    
+        }
+
+        total_server_uptime = {
+            'Triage': server_uptime['Triage'].area,
+            'Workup': server_uptime['Workup'].area,
+            'Specialist': server_uptime['Specialist'].area
+        }
+
+        server_utilization_rate = {
+            'Triage': (server_uptime['Triage'].area/(max_num_servers['nurses'] * clock)) * 100,
+            'Workup': (server_uptime['Workup'].area/(max_num_servers['doctors'] * clock)) * 100,
+            'Specialist': (server_uptime['Specialist'].area/(max_num_servers['specialists'] * clock)) * 100
+        }
+
+        server_idle_rate = {
+            'Triage': (1 - (server_uptime['Triage'].area/(max_num_servers['nurses'] * clock))) * 100,
+            'Workup': (1 - (server_uptime['Workup'].area/(max_num_servers['doctors'] * clock))) * 100,
+            'Specialist': (1 - (server_uptime['Specialist'].area/(max_num_servers['specialists'] * clock))) * 100
+        }
+
+        time_percentage_of_ambulances_in_diversion = self.time_in_diversion.area/(10 * clock) * 100
+
+        return {'Time Weighted Average Queues':time_weighted_average_queues, 
+                'Average Queue Time Per Customer': average_queue_time_per_customer, 
+                'Max Queue Lengths': dict(self.max_queue_lengths),
+                'Total Server Uptime': total_server_uptime,
+                'Server Utilization Rate': server_utilization_rate,
+                'Server Idle Rate': server_idle_rate,
+                'Percentage of Time Ambulances Spent in Diversion': {'Ambulance Diversion':time_percentage_of_ambulances_in_diversion}}
+
+    def patient_time_percentiles(self, percentiles=(50, 90, 99)):
+        """
+        Returns the percentiles, mean and count of every per-patient measure (see
+        PATIENT_TIME_MEASURES) for each (triage type, arrival type) group of the patients that
+        left after the warmup, plus an "All" group combining them.
+        """
+        def summary(sketch):
+            values = {"count": sketch.count, "mean": sketch.mean()}
+            for percentile in percentiles:
+                values[f"p{percentile}"] = sketch.quantile(percentile / 100)
+            return values
+
+        patient_time_percentiles = {}
+        for measure, sketches in self.patient_times.items():
+            combined = QuantileSketch()
+            for sketch in sketches.values():
+                combined.merge(sketch)
+            patient_time_percentiles[measure] = {group: summary(sketches[group]) for group in sorted(sketches)}
+            patient_time_percentiles[measure]["All"] = summary(combined)
+        return patient_time_percentiles
+
+    ######################################### MONITORING #########################################
+
+    def reading(self, time=None):
+        """
+        Returns the current state of the ED: queue lengths, busy servers, free beds per zone,
+        ambulances in diversion and patients in and out so far, stamped with the given time
+        (the clock by default).
+        """
+        return {
+            "time": self.clock if time is None else time,
+            "queues": {
+                "Triage": self.number_triage_queue,
+                "Bed": self.number_waiting_for_bed_queue,
+                "Workup": self.number_workup_queue,
+                "Specialist": self.number_specialist_queue,
+            },
+            "busy_servers": {
+                "Triage": self.status_triage_nurses,
+                "Workup": self.status_workup_doctors,
+                "Specialist": self.status_specialists,
+            },
+            "free_beds": dict(self.number_of_beds_per_zone),
+            "diverted_ambulances": self.diverted_ambulances,
+            "patients": dict(self.total_patients),
+        }
+
+    def _readings(self, interval_minutes, until):
+        """
+        Advances the simulation, yielding a reading every interval_minutes from the current
+        clock. The state only changes at events, so the reading at any time before the next
+        event is the current state.
+        """
+        next_reading = self.clock
+        while until is None or next_reading <= until:
+            next_event_time = self.fel.peek().time
+            while next_reading < next_event_time and (until is None or next_reading <= until):
+                yield self.reading(next_reading)
+                next_reading += interval_minutes
+            self.step()
+
+    def iter_snapshots(self, interval_minutes, until=None, buffer_size=1024, background=False):
+        """
+        Advances the simulation, yielding a reading of the state of the ED (see reading())
+        every interval_minutes of simulated time from the current clock, up to the given time
+        (forever by default). Breaking out of the iteration stops the simulation where it is.
+
+        By default the simulation only advances when the next reading is requested. With
+        background, it runs ahead in a separate thread and its readings are passed through a
+        ring buffer of buffer_size readings: if the consumer falls further behind, the oldest
+        readings are dropped and the next reading yielded counts them in its "dropped" field,
+        so a slow consumer never makes memory grow. Without background, "dropped" is always 0.
+        """
+        if not background:
+            for reading in self._readings(interval_minutes, until):
+                reading["dropped"] = 0
+                yield reading
+            return
+
+        readings = deque(maxlen=buffer_size)
+        condition = threading.Condition()
+        state = {"dropped": 0, "finished": False, "stopped": False, "error": None}
+
+        def produce():
+            try:
+                for reading in self._readings(interval_minutes, until):
+                    with condition:
+                        if state["stopped"]:
+                            return
+                        if len(readings) == buffer_size:
+                            state["dropped"] += 1
+                        readings.append(reading)
+                        condition.notify()
+            except BaseException as error:
+                state["error"] = error
+            finally:
+                with condition:
+                    state["finished"] = True
+                    condition.notify()
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                with condition:
+                    condition.wait_for(lambda: readings or state["finished"])
+                    if not readings:
+                        break
+                    reading = readings.popleft()
+                    reading["dropped"], state["dropped"] = state["dropped"], 0
+                yield reading
+            if state["error"] is not None:
+                raise state["error"]
+        finally:
+            with condition:
+                state["stopped"] = True
+            producer.join()
+
+def emergency_department_simulation(simulation_time, seed=None):
+   """
+   Runs the emergency department simulation for the given number of minutes and returns
+   its statistics.
+   """
+   return EDSimulation(seed=seed).run(simulation_time)
+
+def run_replication(simulation_time, seed_sequence, configuration=None, snapshot=None):
+   """
+   Runs a single replication of the simulation. The random streams of the replication
+   are spawned from its own SeedSequence so that every replication is independent,
+   whichever worker process it lands on. The configuration is a dict of keyword arguments
+   for EDSimulation (e.g. max_num_servers, number_of_beds_per_zone).
+
+   If a snapshot is given, the replication resumes from it with fresh random streams
+   instead of starting empty (only staffing and beds can then be configured).
+   """
+   if snapshot is not None:
+      simulation = EDSimulation.from_snapshot(snapshot, seed=seed_sequence, **(configuration or {}))
+   else:
+      simulation = EDSimulation(seed=seed_sequence, **(configuration or {}))
+   return simulation.run(simulation_time)
+
+def replication_seeds(number_of_replications, seed=None):
+   """
+   Spawns the SeedSequences of the replications from a seed (or a SeedSequence).
+   """
+   if not isinstance(seed, np.random.SeedSequence):
+      seed = np.random.SeedSequence(seed)
+   return seed.spawn(number_of_replications)
+
+def run_replications(number_of_replications, simulation_time, max_workers=None, seed=None, configuration=None,
+                     snapshot=None):
+   """
+   Runs independent replications of the simulation across a pool of worker processes
+   and returns the list of their results, in replication order.
+
+   Each replication is given a child of a single SeedSequence (built from the seed, or
+   the seed itself if it already is one), so the set of results only depends on the seed
+   and not on the number of workers. Runs with the same seed share their random streams
+   replication by replication, which is what makes comparing two configurations with
+   common random numbers possible.
+
+   With a snapshot (see EDSimulation.warm_up), every replication branches from it
+   instead of simulating the warmup again.
+   """
+   seed_sequences = replication_seeds(number_of_replications, seed)
+   if max_workers == 1:
+      return [run_replication(simulation_time, seed_sequence, configuration, snapshot) for seed_sequence in seed_sequences]
+
+   with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      return list(executor.map(run_replication, [simulation_time] * number_of_replications, seed_sequences,
+                               [configuration] * number_of_replications, [snapshot] * number_of_replications))
+
+def average_results(accumulated_results):
+   """
+   Averages each statistic across the results of several replications.
+   """
+   number_of_replications = len(accumulated_results)
    average_results = {}
    for metric in accumulated_results[0].keys():
       average_results[metric] = {
@@ -830,6 +1728,12 @@ def main():
 
    return average_results
 
+def main(number_of_replications=10, simulation_time=24 * 60 * 180, max_workers=None, seed=None):
+   accumulated_results = run_replications(number_of_replications, simulation_time, max_workers=max_workers, seed=seed)
+
+   # Calculate average across all simulations
+   return average_results(accumulated_results)
+
 if __name__ == '__main__':
    statistics = main()
    for key,value in statistics.items():
@@ -0,0 +1,211 @@
+"""
+Simulation-optimization of the staffing and bed capacity of the emergency department.
+
+minimize_cost() searches a set of configurations (see sweep.configuration_grid) for the
+cheapest one whose mean statistics meet service-level constraints, for example:
+
+   configurations = sweep.configuration_grid(doctors=(2, 3, 4), specialists=(4, 5, 6))
+   constraints = [("Percentage of Time Ambulances Spent in Diversion", "Ambulance Diversion", 10),
+                  ("Time Weighted Average Queues", "Bed", 5)]
+   best = minimize_cost(configurations, constraints)
+
+Instead of running every configuration for a fixed number of replications, replications
+are allocated in rounds: every configuration starts with a few, configurations whose
+confidence intervals show they are clearly infeasible, or more expensive than a
+configuration that is clearly feasible, are dropped, and the replications of the next
+round go to the remaining contenders in proportion to how uncertain their feasibility
+still is (an OCBA-style allocation for feasibility determination).
+"""
+from concurrent.futures import ProcessPoolExecutor
+import json
+import math
+
+import numpy as np
+
+import hospital_sim
+import sweep
+from output_analysis import RunningMoments
+
+# Cost per doctor, nurse, specialist and bed (relative units, e.g. per day)
+DEFAULT_COSTS = {
+    "doctors": 10,
+    "nurses": 5,
+    "specialists": 8,
+    "beds": 1,
+}
+
+def staffing_cost(configuration, costs=DEFAULT_COSTS):
+   """
+   Linear cost of a configuration: its servers and beds, priced with the given costs.
+   """
+   servers = configuration.get("max_num_servers", hospital_sim.MAX_NUM_SERVERS)
+   beds = configuration.get("number_of_beds_per_zone", hospital_sim.NUMBER_OF_BEDS_PER_ZONE)
+   return sum(costs[server] * number for server, number in servers.items()) + costs["beds"] * sum(beds.values())
+
+class Candidate():
+    """
+      A configuration under evaluation, with the running moments of its constrained
+      statistics and its status: "undecided", "feasible", "infeasible" (the confidence
+      interval of a statistic lies above its maximum) or "dominated" (more expensive than
+      a feasible configuration).
+    """
+    def __init__(self, configuration, cost, number_of_constraints):
+        self.configuration = configuration
+        self.cost = cost
+        self.moments = [RunningMoments() for _ in range(number_of_constraints)]
+        self.replications = 0
+        self.status = "undecided"
+
+    def add(self, results, constraints):
+        self.replications += 1
+        for moments, (metric, key, _) in zip(self.moments, constraints):
+            moments.add(results[metric][key])
+
+    def update_status(self, constraints, confidence):
+        if self.status != "undecided":
+            return
+        feasible = True
+        for moments, (_, _, maximum) in zip(self.moments, constraints):
+            half_width = moments.half_width(confidence)
+            if moments.mean - half_width > maximum:
+                self.status = "infeasible"
+                return
+            if moments.mean + half_width > maximum:
+                feasible = False
+        if feasible:
+            self.status = "feasible"
+
+    def uncertainty(self, constraints, confidence):
+        """
+        How many replications the feasibility of the candidate still needs, relatively: the
+        largest (standard deviation / distance of the mean to the maximum)^2 over the
+        constraints not yet satisfied with confidence.
+        """
+        uncertainty = 0
+        for moments, (_, _, maximum) in zip(self.moments, constraints):
+            if moments.mean + moments.half_width(confidence) <= maximum:
+                continue
+            variance = moments.variance()
+            gap = abs(moments.mean - maximum)
+            uncertainty = max(uncertainty, math.inf if gap == 0 else variance / gap ** 2)
+        return uncertainty
+
+    def summary(self, constraints, confidence):
+        return {
+            "configuration": self.configuration,
+            "cost": self.cost,
+            "status": self.status,
+            "replications": self.replications,
+            "statistics": [{"metric": metric, "key": key, "maximum": maximum,
+                            **moments.interval(confidence)}
+                           for moments, (metric, key, maximum) in zip(self.moments, constraints)],
+        }
+
+def allocate(candidates, constraints, number_of_replications, max_replications, confidence=0.95):
+   """
+   Splits number_of_replications between the candidates in proportion to their
+   uncertainty, without giving any candidate more than max_replications in total.
+   Returns the number of replications of every candidate.
+   """
+   uncertainties = [min(candidate.uncertainty(constraints, confidence), 1e12) for candidate in candidates]
+   total = sum(uncertainties)
+   if total == 0:
+      uncertainties, total = [1] * len(candidates), len(candidates)
+   allocation = [min(math.floor(number_of_replications * uncertainty / total), max_replications - candidate.replications)
+                 for uncertainty, candidate in zip(uncertainties, candidates)]
+   # Replications lost to rounding go to the most uncertain candidates
+   for index in sorted(range(len(candidates)), key=lambda index: -uncertainties[index]):
+      if sum(allocation) >= number_of_replications:
+         break
+      if candidates[index].replications + allocation[index] < max_replications:
+         allocation[index] += 1
+   return allocation
+
+def minimize_cost(configurations, constraints, cost=staffing_cost, simulation_time=24 * 60 * 60,
+                  initial_replications=3, replications_per_round=None, max_replications=30,
+                  budget=None, confidence=0.95, seed=0, max_workers=None, cache=None):
+   """
+   Finds the cheapest configuration whose statistics meet the constraints, a list of
+   (metric, key, maximum) on the mean results of a replication of simulation_time minutes.
+
+   Every configuration gets initial_replications, then rounds of replications_per_round
+   (by default as many as there are configurations) are allocated to the configurations
+   still in contention, until the cheapest feasible configuration is known, the total
+   budget of replications is spent, or every contender has max_replications. Replication i
+   of every configuration uses the same random streams (common random numbers), which
+   sharpens the comparisons. With a cache (a sweep.ResultCache), replications already run
+   by a sweep or a previous search are reused, unless the seed is None.
+
+   Returns the best configuration (None if none was shown feasible) and its cost, with the
+   status, number of replications and confidence intervals of every configuration.
+   """
+   constraints = [tuple(constraint) for constraint in constraints]
+   candidates = [Candidate(configuration, cost(configuration), len(constraints)) for configuration in configurations]
+   replications_per_round = replications_per_round or len(candidates)
+   if seed is None:
+      # Fresh streams shared by the whole search, whose replications can never be reused
+      seed, cache = np.random.SeedSequence(), None
+   seed_sequences = hospital_sim.replication_seeds(max_replications, seed)
+   version = sweep.code_version() if cache is not None else None
+   total_replications = 0
+
+   def run(executor, allocation):
+      tasks, cached = [], []
+      for candidate, number in zip(candidates, allocation):
+         for replication in range(candidate.replications, candidate.replications + number):
+            key = sweep.ResultCache.key(candidate.configuration, seed_sequences[replication], simulation_time, version)
+            results = cache.get(key) if cache is not None else None
+            if results is None:
+               tasks.append((candidate, replication, key))
+            else:
+               cached.append((candidate, results))
+      computed = executor.map(hospital_sim.run_replication, [simulation_time] * len(tasks),
+                              [seed_sequences[replication] for _, replication, _ in tasks],
+                              [candidate.configuration for candidate, _, _ in tasks])
+      for (candidate, _, key), results in zip(tasks, computed):
+         results = json.loads(json.dumps(results, default=float))
+         if cache is not None:
+            cache.put(key, results)
+         cached.append((candidate, results))
+      for candidate, results in cached:
+         candidate.add(results, constraints)
+      return len(cached)
+
+   with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      allocation = [min(initial_replications, max_replications)] * len(candidates)
+      if budget is not None and sum(allocation) > budget:
+         # Spread the budget as evenly as possible, the cheapest candidates first
+         share, remainder = divmod(budget, len(candidates))
+         order = sorted(range(len(candidates)), key=lambda index: candidates[index].cost)
+         for rank, index in enumerate(order):
+            allocation[index] = min(allocation[index], share + (rank < remainder))
+      while True:
+         total_replications += run(executor, allocation)
+
+         for candidate in candidates:
+            candidate.update_status(constraints, confidence)
+         feasible_costs = [candidate.cost for candidate in candidates if candidate.status == "feasible"]
+         best_cost = min(feasible_costs, default=math.inf)
+         for candidate in candidates:
+            if candidate.status in ("undecided", "feasible") and candidate.cost > best_cost:
+               candidate.status = "dominated"
+
+         contenders = [candidate for candidate in candidates
+                       if candidate.status == "undecided" and candidate.replications < max_replications]
+         remaining_budget = math.inf if budget is None else budget - total_replications
+         if not contenders or remaining_budget <= 0:
+            break
+         number_of_replications = int(min(replications_per_round, remaining_budget))
+         round_allocation = allocate(contenders, constraints, number_of_replications, max_replications, confidence)
+         allocation = [round_allocation[contenders.index(candidate)] if candidate in contenders else 0
+                       for candidate in candidates]
+
+   feasible = [candidate for candidate in candidates if candidate.status == "feasible"]
+   best = min(feasible, key=lambda candidate: candidate.cost, default=None)
+   return {
+      "best": best.configuration if best is not None else None,
+      "cost": best.cost if best is not None else None,
+      "replications": total_replications,
+      "candidates": sorted((candidate.summary(constraints, confidence) for candidate in candidates),
+                           key=lambda summary: summary["cost"]),
+   }
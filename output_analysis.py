@@ -0,0 +1,390 @@
+"""
+Output analysis for the emergency department simulation: confidence intervals on the
+statistics returned by EDSimulation.results(), and replication strategies built on them.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+import math
+import os
+
+import numpy as np
+
+import hospital_sim
+
+def t_quantile(probability, degrees_of_freedom):
+   """
+   Quantile of Student's t distribution. It is exact for 1 and 2 degrees of freedom, which
+   have closed forms. Otherwise it comes from the Cornish-Fisher expansion around the
+   normal quantile. At the 99% level that expansion is accurate to about 5e-2 at 3 degrees
+   of freedom and 3e-3 at 5, and better at lower levels.
+   """
+   n = degrees_of_freedom
+   if n == 1:
+      return math.tan(math.pi * (probability - 0.5))
+   if n == 2:
+      return (2 * probability - 1) / math.sqrt(2 * probability * (1 - probability))
+   z = NormalDist().inv_cdf(probability)
+   return (z
+           + (z ** 3 + z) / (4 * n)
+           + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * n ** 2)
+           + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * n ** 3)
+           + (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / (92160 * n ** 4))
+
+class RunningMoments():
+    """
+      Streaming mean and variance of a sequence of observations (Welford's algorithm).
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0
+        self._sum_of_squares = 0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._sum_of_squares += delta * (value - self.mean)
+
+    def variance(self):
+        return self._sum_of_squares / (self.count - 1) if self.count > 1 else math.inf
+
+    def half_width(self, confidence=0.95):
+        """
+        Half-width of the confidence interval on the mean.
+        """
+        if self.count < 2:
+            return math.inf
+        return t_quantile(1 - (1 - confidence) / 2, self.count - 1) * math.sqrt(self.variance() / self.count)
+
+    def interval(self, confidence=0.95):
+        half_width = self.half_width(confidence)
+        return {
+            "mean": self.mean,
+            "half_width": half_width,
+            "relative_half_width": half_width / abs(self.mean) if self.mean else (0 if half_width == 0 else math.inf),
+            "observations": self.count,
+        }
+
+def flatten_results(results):
+   """
+   Turns a results dict into {(metric, key): value}.
+   """
+   return {(metric, key): value for metric, values in results.items() for key, value in values.items()}
+
+def run_sequential_replications(simulation_time=24 * 60 * 180, metrics=None, relative_precision=0.05,
+                                confidence=0.95, initial_replications=5, batch_size=None,
+                                max_replications=100, seed=None, max_workers=None, configuration=None,
+                                snapshot=None):
+   """
+   Runs replications in parallel batches until the confidence interval of every requested
+   metric has a relative half-width of at most relative_precision, or max_replications
+   have been run.
+
+   The metrics are (metric, key) pairs of the results, e.g. ("Max Queue Lengths", "Bed");
+   all of them by default. Returns the averaged results, in the same format as main(),
+   with the achieved intervals of every metric.
+   """
+   batch_size = batch_size or max_workers or os.cpu_count()
+   seed_sequences = hospital_sim.replication_seeds(max_replications, seed)
+   moments = {}
+   accumulated_results = []
+
+   def converged():
+      return all(moments[metric].interval(confidence)["relative_half_width"] <= relative_precision
+                 for metric in (metrics or moments))
+
+   with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      number_to_run = min(initial_replications, max_replications)
+      while number_to_run > 0:
+         batch = seed_sequences[len(accumulated_results):len(accumulated_results) + number_to_run]
+         for results in executor.map(hospital_sim.run_replication, [simulation_time] * len(batch), batch,
+                                     [configuration] * len(batch), [snapshot] * len(batch)):
+            accumulated_results.append(results)
+            for metric, value in flatten_results(results).items():
+               moments.setdefault(metric, RunningMoments()).add(value)
+
+         if converged():
+            break
+         number_to_run = min(batch_size, max_replications - len(accumulated_results))
+
+   intervals = {}
+   for (metric, key), metric_moments in moments.items():
+      intervals.setdefault(metric, {})[key] = metric_moments.interval(confidence)
+
+   return {
+      "results": hospital_sim.average_results(accumulated_results),
+      "intervals": intervals,
+      "replications": len(accumulated_results),
+      "converged": converged(),
+   }
+
+# How the values of consecutive batches combine into the value of the merged batch: summed,
+# maximum, or averaged weighted by the batch length or by the number of departures
+ADDITIVE_METRICS = {"Total Server Uptime"}
+MAXIMUM_METRICS = {"Max Queue Lengths"}
+PER_DEPARTURE_METRICS = {"Average Queue Time Per Customer"}
+
+def iter_batches(simulation, batch_length, until):
+   """
+   Advances the simulation until its clock passes the given time, resetting its statistics
+   every batch_length minutes, and yields a summary of every batch as it completes: its
+   index, start and end times, number of departures and results.
+   """
+   index = 0
+   while simulation.clock <= until:
+      start = simulation.clock
+      simulation.reset_statistics()
+      while simulation.clock <= min(start + batch_length, until):
+         simulation.step()
+      yield {
+         "batch": index,
+         "start": start,
+         "end": simulation.clock,
+         "departures": simulation.total_patients["out"],
+         "results": simulation.results(),
+      }
+      index += 1
+
+def merge_batches(batches):
+   """
+   Combines consecutive batch summaries into the summary of one batch spanning them.
+   """
+   lengths = [batch["end"] - batch["start"] for batch in batches]
+   departures = [batch["departures"] for batch in batches]
+   merged = {}
+   for metric, values in batches[0]["results"].items():
+      if metric in ADDITIVE_METRICS:
+         combine = lambda key: sum(batch["results"][metric][key] for batch in batches)
+      elif metric in MAXIMUM_METRICS:
+         combine = lambda key: max(batch["results"][metric][key] for batch in batches)
+      else:
+         weights = departures if metric in PER_DEPARTURE_METRICS else lengths
+         combine = lambda key: sum(weight * batch["results"][metric][key]
+                                   for weight, batch in zip(weights, batches)) / (sum(weights) or 1)
+      merged[metric] = {key: combine(key) for key in values}
+   return {
+      "batch": batches[0]["batch"],
+      "start": batches[0]["start"],
+      "end": batches[-1]["end"],
+      "departures": sum(departures),
+      "results": merged,
+   }
+
+def lag_one_autocorrelation(values):
+   mean = sum(values) / len(values)
+   deviations = [value - mean for value in values]
+   sum_of_squares = sum(deviation * deviation for deviation in deviations)
+   if sum_of_squares == 0:
+      return 0
+   return sum(a * b for a, b in zip(deviations, deviations[1:])) / sum_of_squares
+
+def run_batch_means(simulation_time=24 * 60 * 180, base_batch_length=24 * 60, minimum_batches=10,
+                    maximum_autocorrelation=0.2, metrics=None, confidence=0.95, seed=None,
+                    configuration=None, warmup_time=hospital_sim.WARMUP_TIME, on_batch=None):
+   """
+   Estimates the steady-state statistics from a single long run with one warmup, instead of
+   independent replications, by the method of batch means.
+
+   After the warmup, the run is split into base batches of base_batch_length minutes, each
+   passed to on_batch (if given) as soon as it completes. The batch size is then chosen
+   automatically: adjacent batches are merged, doubling their size, until the lag-1
+   autocorrelation of the batch values of every metric (all of them by default) is at most
+   maximum_autocorrelation, or merging again would leave fewer than minimum_batches.
+
+   Returns the results over the batches used, in the same format as main() (base batches
+   left over after the last full batch are left out of both the results and the
+   intervals), with the batch-means confidence intervals of every metric. Intervals of the
+   Max Queue Lengths are on the maximum within a batch.
+   """
+   simulation = hospital_sim.EDSimulation(seed=seed, warmup_time=warmup_time, **(configuration or {}))
+   while simulation.clock <= warmup_time:
+      simulation.step()
+
+   base_batches = []
+   for batch in iter_batches(simulation, base_batch_length, simulation_time):
+      base_batches.append(batch)
+      if on_batch is not None:
+         on_batch(batch)
+
+   def batch_values(batches):
+      values = {}
+      for batch in batches:
+         for metric, value in flatten_results(batch["results"]).items():
+            values.setdefault(metric, []).append(value)
+      return values
+
+   batch_size = 1
+   while True:
+      number_of_batches = len(base_batches) // batch_size
+      batches = [merge_batches(base_batches[i * batch_size:(i + 1) * batch_size]) for i in range(number_of_batches)]
+      values = batch_values(batches)
+      uncorrelated = all(lag_one_autocorrelation(values[metric]) <= maximum_autocorrelation
+                         for metric in (metrics or values))
+      if uncorrelated or len(base_batches) // (batch_size * 2) < minimum_batches:
+         break
+      batch_size *= 2
+
+   intervals = {}
+   for (metric, key), metric_values in values.items():
+      moments = RunningMoments()
+      for value in metric_values:
+         moments.add(value)
+      interval = moments.interval(confidence)
+      if metric in ADDITIVE_METRICS: # The estimate is the total over all the batches
+         interval["mean"] *= number_of_batches
+         interval["half_width"] *= number_of_batches
+      intervals.setdefault(metric, {})[key] = interval
+
+   return {
+      "results": merge_batches(base_batches[:number_of_batches * batch_size])["results"],
+      "intervals": intervals,
+      "batch_length": batch_size * base_batch_length,
+      "batches": number_of_batches,
+      "uncorrelated": uncorrelated,
+   }
+
+def mser_truncation(series, batch_size=5):
+   """
+   MSER truncation point of a series of observations: the number of leading observations
+   to delete that minimises the marginal standard error of the mean of the rest, computed on
+   the means of batches of batch_size observations (MSER-5 by default). Only the first half
+   of the series is considered, past it the estimate is unreliable.
+   """
+   number_of_batches = len(series) // batch_size
+   if number_of_batches < 2:
+      return 0
+   batch_means = np.asarray(series[:number_of_batches * batch_size], dtype=float).reshape(number_of_batches, batch_size).mean(axis=1)
+
+   # Sums over batch_means[d:] for every truncation d, from reversed cumulative sums
+   sums = np.cumsum(batch_means[::-1])[::-1]
+   sums_of_squares = np.cumsum(batch_means[::-1] ** 2)[::-1]
+   remaining = np.arange(number_of_batches, 0, -1)
+   mser = (sums_of_squares - sums ** 2 / remaining) / remaining ** 2
+   return int(np.argmin(mser[:number_of_batches // 2 + 1])) * batch_size
+
+def run_pilot(simulation_time, interval, seed_sequence, configuration=None):
+   """
+   Runs a replication without warmup, keeping per-interval averages, and returns the
+   interval series of the queue lengths, busy servers and ambulances in diversion.
+   """
+   simulation = hospital_sim.EDSimulation(seed=seed_sequence, statistics_window=interval, warmup_time=0,
+                                          **(configuration or {}))
+   simulation.run(simulation_time)
+   statistics = {("Queue", name): statistic for name, statistic in simulation.time_weighted_queue.items()}
+   statistics.update({("Busy Servers", name): statistic for name, statistic in simulation.server_uptime.items()})
+   statistics[("Diversion", "Ambulance Diversion")] = simulation.time_in_diversion
+   number_of_intervals = int(simulation_time // interval) # Complete intervals only
+   return {name: [statistic.window_areas.get(window, 0) / interval for window in range(number_of_intervals)]
+           for name, statistic in statistics.items()}
+
+def detect_warmup(pilot_time=24 * 60 * 60, number_of_pilots=5, interval=60, batch_size=5,
+                  seed=None, configuration=None, max_workers=None):
+   """
+   Chooses the warmup period of a configuration with MSER-5. Pilot replications of
+   pilot_time minutes are run without warmup, their per-interval series of queue
+   lengths, busy servers and ambulances in diversion are averaged across the pilots, and each
+   averaged series is truncated with mser_truncation().
+
+   Returns the warmup time (the latest truncation point of any series, in minutes) along
+   with the truncation point of every series. The warmup time can be given to EDSimulation
+   (or in a configuration) as warmup_time. If a series is truncated at half the pilot time,
+   the limit of MSER, at_limit is set: the pilots are too short (or the system unstable).
+   """
+   seed_sequences = hospital_sim.replication_seeds(number_of_pilots, seed)
+   with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      pilots = list(executor.map(run_pilot, [pilot_time] * number_of_pilots, [interval] * number_of_pilots,
+                                 seed_sequences, [configuration] * number_of_pilots))
+
+   truncation_points = {}
+   for name in pilots[0]:
+      averaged_series = np.mean([pilot[name] for pilot in pilots], axis=0)
+      truncation_points.setdefault(name[0], {})[name[1]] = mser_truncation(averaged_series, batch_size) * interval
+   warmup_time = max(time for points in truncation_points.values() for time in points.values())
+   number_of_batches = int(pilot_time // interval) // batch_size
+   return {
+      "warmup_time": warmup_time,
+      "at_limit": warmup_time >= (number_of_batches // 2) * batch_size * interval,
+      "truncation_points": truncation_points,
+      "pilot_time": pilot_time,
+      "pilots": number_of_pilots,
+   }
+
+def run_replications_with_detected_warmup(number_of_replications=10, simulation_time=24 * 60 * 180, seed=None,
+                                          configuration=None, max_workers=None, **detection):
+   """
+   Detects the warmup period of the configuration with detect_warmup() (given the keyword
+   arguments in detection), then runs the replications with it. Returns the averaged
+   results, in the same format as main(), along with the outcome of the detection.
+   """
+   detection_seed, replications_seed = hospital_sim.replication_seeds(2, seed)
+   warmup = detect_warmup(seed=detection_seed, configuration=configuration, max_workers=max_workers, **detection)
+   configuration = dict(configuration or {}, warmup_time=warmup["warmup_time"])
+   accumulated_results = hospital_sim.run_replications(number_of_replications, simulation_time, max_workers=max_workers,
+                                                       seed=replications_seed, configuration=configuration)
+   return {
+      "results": hospital_sim.average_results(accumulated_results),
+      "warmup": warmup,
+   }
+
+def run_antithetic_pair(simulation_time, seed_sequence, configuration=None):
+   """
+   Runs a replication and its antithetic counterpart (same seed, complementary uniforms).
+   """
+   configuration = configuration or {}
+   return (hospital_sim.run_replication(simulation_time, seed_sequence, configuration),
+           hospital_sim.run_replication(simulation_time, seed_sequence, dict(configuration, antithetic=True)))
+
+def run_antithetic_replications(number_of_pairs=5, simulation_time=24 * 60 * 180, confidence=0.95, seed=None,
+                                max_workers=None, configuration=None):
+   """
+   Runs replications in antithetic pairs: the second run of every pair uses the complement
+   of every uniform of the first (arrival gaps, triage types, service times, procedures,
+   ambulance travel), so that their errors tend to cancel out.
+
+   The estimate of every metric is the mean of the pair averages, with its confidence
+   interval over the pairs. The variance reduction of every metric compares the variance
+   of a pair average with that of the average of two independent runs (estimated from the
+   first and second runs of the pairs separately): 0.5 means that the pairs reach the
+   precision of independent replications with half the runs. Returns the averaged results,
+   in the same format as main(), with the intervals, the variance reductions and the
+   correlation within the pairs.
+   """
+   seed_sequences = hospital_sim.replication_seeds(number_of_pairs, seed)
+   if max_workers == 1:
+      pairs = [run_antithetic_pair(simulation_time, seed_sequence, configuration) for seed_sequence in seed_sequences]
+   else:
+      with ProcessPoolExecutor(max_workers=max_workers) as executor:
+         pairs = list(executor.map(run_antithetic_pair, [simulation_time] * number_of_pairs, seed_sequences,
+                                   [configuration] * number_of_pairs))
+
+   intervals, variance_reductions, correlations = {}, {}, {}
+   flattened = [(flatten_results(first), flatten_results(second)) for first, second in pairs]
+   for metric, key in flattened[0][0]:
+      firsts = [first[(metric, key)] for first, _ in flattened]
+      seconds = [second[(metric, key)] for _, second in flattened]
+      averages, first_moments, second_moments = RunningMoments(), RunningMoments(), RunningMoments()
+      for first, second in zip(firsts, seconds):
+         averages.add((first + second) / 2)
+         first_moments.add(first)
+         second_moments.add(second)
+      intervals.setdefault(metric, {})[key] = averages.interval(confidence)
+
+      independent_variance = (first_moments.variance() + second_moments.variance()) / 2
+      covariance = sum((first - first_moments.mean) * (second - second_moments.mean)
+                       for first, second in zip(firsts, seconds)) / (number_of_pairs - 1) if number_of_pairs > 1 else 0
+      if independent_variance and not math.isinf(independent_variance):
+         variance_reduction = 1 - averages.variance() / (independent_variance / 2)
+         correlation = covariance / math.sqrt(first_moments.variance() * second_moments.variance()) \
+                       if first_moments.variance() and second_moments.variance() else 0
+      else:
+         variance_reduction, correlation = 0, 0
+      variance_reductions.setdefault(metric, {})[key] = variance_reduction
+      correlations.setdefault(metric, {})[key] = correlation
+
+   return {
+      "results": hospital_sim.average_results([results for pair in pairs for results in pair]),
+      "intervals": intervals,
+      "variance_reduction": variance_reductions,
+      "correlation": correlations,
+      "pairs": number_of_pairs,
+   }
@@ -0,0 +1,287 @@
+"""
+Long-lived simulation worker service for many small what-if scenarios.
+
+Starting a Python process, importing NumPy and the simulation for every scenario costs
+more than a short-horizon run itself. The service keeps a pool of warm worker processes
+behind a Unix socket and answers scenario jobs with only the cost of the simulation:
+
+   python service.py --socket /tmp/ed_sim.sock --workers 4
+
+Clients send one JSON object per line. A job names its replications and configuration:
+
+   {"type": "run", "id": "a", "simulation_time": 43200, "replications": 4, "seed": 1,
+    "configuration": {"max_num_servers": {"doctors": 3, "nurses": 2, "specialists": 5},
+                      "number_of_beds_per_zone": {"1": 12, "2": 10, "3": 10, "4": 10}}}
+
+and the service streams back, one JSON object per line, an "accepted" message, a
+"replication" message with the results of every replication as it completes, then a "done"
+message with the averaged results (or "error", or "cancelled"). A job is cancelled with
+{"type": "cancel", "id": "a"}: its queued replications are dropped, and those already
+running are left to finish but not reported.
+
+The configuration holds keyword arguments of EDSimulation. As JSON object keys are
+strings, zones and arrival types are given as "1", and the triage type and chief
+complaint keys of a procedure_mix as "1,2". Jobs longer than max_simulation_time or with
+more than max_replications are rejected, so no job can hold a worker indefinitely.
+
+Backpressure: at most max_pending replications wait for or run on the pool at once,
+counting those of cancelled jobs until the pool is done with them. Jobs take turns
+submitting their replications, so a large job is fed to the workers gradually and small
+jobs submitted meanwhile are not stuck behind all of it. Jobs beyond max_jobs in
+progress are rejected with a "busy" message rather than queued without bound. Messages to
+a slow client wait for its socket to drain, which in turn holds back its jobs.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+
+import numpy as np
+
+import hospital_sim
+
+DEFAULT_SOCKET_PATH = "ed_sim.sock"
+
+# Configuration arguments keyed by integers (zones, arrival types) in the simulation
+INTEGER_KEYED_ARGUMENTS = ("number_of_beds_per_zone", "arrival_rates")
+
+def warm_worker():
+   """
+   Initializer of the worker processes: runs a tiny simulation so that every import and
+   lazily built table is in place before the first job arrives.
+   """
+   hospital_sim.EDSimulation(seed=0).run(60)
+
+def run_job_replication(simulation_time, seed_sequence, configuration):
+   # Round trip through JSON in the worker, so the results are ready to send
+   return json.loads(json.dumps(hospital_sim.run_replication(simulation_time, seed_sequence, configuration),
+                                default=float))
+
+def scenario_configuration(configuration):
+   """
+   Converts the configuration of a JSON job into keyword arguments for EDSimulation,
+   restoring the integer and tuple keys that JSON turned into strings.
+   """
+   if configuration is None:
+      return {}
+   if not isinstance(configuration, dict):
+      raise ValueError("the configuration must be a JSON object")
+   configuration = dict(configuration)
+   for argument in INTEGER_KEYED_ARGUMENTS:
+      if argument in configuration:
+         configuration[argument] = {int(key): value for key, value in configuration[argument].items()}
+   if "procedure_mix" in configuration:
+      configuration["procedure_mix"] = {
+         tuple(int(part) for part in key.split(",")): [tuple(procedure) for procedure in procedures]
+         for key, procedures in configuration["procedure_mix"].items()
+      }
+   return configuration
+
+def parse_job(request, max_replications, max_simulation_time):
+   """
+   Checks a job and returns its simulation time, number of replications, root
+   SeedSequence and configuration. Raises ValueError if the job is not valid.
+   """
+   simulation_time = request.get("simulation_time")
+   # json.loads accepts Infinity and NaN, which must not reach a worker
+   if isinstance(simulation_time, bool) or not isinstance(simulation_time, (int, float)) or \
+      not math.isfinite(simulation_time) or not 0 < simulation_time <= max_simulation_time:
+      raise ValueError(f"simulation_time must be a number of minutes from 0 to {max_simulation_time}")
+   number_of_replications = request.get("replications", 1)
+   if isinstance(number_of_replications, bool) or not isinstance(number_of_replications, int) or \
+      not 1 <= number_of_replications <= max_replications:
+      raise ValueError(f"replications must be an integer from 1 to {max_replications}")
+   seed = request.get("seed")
+   if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int) or seed < 0):
+      raise ValueError("seed must be a non-negative integer")
+   return simulation_time, number_of_replications, np.random.SeedSequence(seed), \
+          scenario_configuration(request.get("configuration"))
+
+class SimulationService():
+    """
+      Dispatches scenario jobs from the clients of a Unix socket to a pool of warm worker
+      processes, and streams their results back.
+    """
+    def __init__(self, max_workers=None, max_pending=None, max_jobs=64, max_replications=1000,
+                 max_simulation_time=24 * 60 * 365):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.max_workers
+        self.max_jobs = max_jobs
+        self.max_replications = max_replications
+        self.max_simulation_time = max_simulation_time
+        self.executor = None
+        self.pending = None
+        self.jobs_in_progress = 0
+
+    def start_workers(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=warm_worker)
+        # Start every worker now instead of on the first jobs
+        for future in [self.executor.submit(os.getpid) for _ in range(self.max_workers)]:
+            future.result()
+
+    async def serve(self, path=DEFAULT_SOCKET_PATH):
+        """
+        Starts the workers and serves clients on the Unix socket at path until cancelled.
+        """
+        self.pending = asyncio.Semaphore(self.max_pending)
+        self.start_workers()
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle_client, path=path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            if os.path.exists(path):
+                os.unlink(path)
+
+    async def handle_client(self, reader, writer):
+        jobs = {}
+        lock = asyncio.Lock()
+
+        async def send(message):
+            async with lock:
+                try:
+                    writer.write(json.dumps(message).encode() + b"\n")
+                    await writer.drain()
+                except ConnectionError:
+                    # The client went away, and its jobs are cancelled when its reader sees it
+                    pass
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as error:
+                    await send({"event": "error", "error": f"invalid JSON: {error}"})
+                    continue
+                if not isinstance(request, dict):
+                    await send({"event": "error", "error": "a request must be a JSON object"})
+                    continue
+                job_id = request.get("id")
+                if request.get("type") == "cancel":
+                    job = jobs.get(job_id)
+                    if job is not None:
+                        job.cancel()
+                    else:
+                        await send({"id": job_id, "event": "error", "error": "unknown job"})
+                elif request.get("type", "run") == "run":
+                    if job_id in jobs:
+                        await send({"id": job_id, "event": "error", "error": "job id already in use"})
+                    elif self.jobs_in_progress >= self.max_jobs:
+                        await send({"id": job_id, "event": "busy"})
+                    else:
+                        try:
+                            scenario = parse_job(request, self.max_replications, self.max_simulation_time)
+                        except (ValueError, TypeError, AttributeError) as error:
+                            await send({"id": job_id, "event": "error", "error": f"invalid job: {error}"})
+                            continue
+                        await send({"id": job_id, "event": "accepted", "replications": scenario[1]})
+                        self.jobs_in_progress += 1
+                        jobs[job_id] = asyncio.create_task(self.run_job(job_id, *scenario, send))
+                        jobs[job_id].add_done_callback(
+                            lambda job, job_id=job_id: self.finish_job(jobs, job_id, job, send))
+                else:
+                    await send({"id": job_id, "event": "error", "error": f"unknown request type {request['type']!r}"})
+        except ConnectionError:
+            pass
+        finally:
+            # Jobs of a client that went away are of no use to anyone
+            for job in list(jobs.values()):
+                job.cancel()
+            writer.close()
+
+    def finish_job(self, jobs, job_id, job, send):
+        self.jobs_in_progress -= 1
+        del jobs[job_id]
+        if job.cancelled():
+            asyncio.ensure_future(send({"id": job_id, "event": "cancelled"}))
+
+    async def run_job(self, job_id, simulation_time, number_of_replications, seed_sequence, configuration, send):
+        loop = asyncio.get_running_loop()
+        futures = []
+        works = []
+
+        def release(_):
+            # Called from the executor's thread when the pool is done with a replication
+            try:
+                loop.call_soon_threadsafe(self.pending.release)
+            except RuntimeError: # The event loop is closed, the service is shutting down
+                pass
+
+        try:
+            async def run(replication, work):
+                results = await asyncio.wrap_future(work)
+                await send({"id": job_id, "event": "replication", "replication": replication, "results": results})
+                return results
+
+            # A job waits for a free slot before submitting each of its replications, so jobs
+            # waiting for the pool take turns instead of queueing all their replications at once
+            for replication in range(number_of_replications):
+                await self.pending.acquire()
+                try:
+                    # Spawned one at a time, the same children as replication_seeds() would give
+                    work = self.executor.submit(run_job_replication, simulation_time, seed_sequence.spawn(1)[0],
+                                                configuration)
+                except BaseException:
+                    self.pending.release()
+                    raise
+                # The slot is freed when the pool is done with the replication, not when the job
+                # stops waiting for it: a cancelled replication already running still holds it
+                work.add_done_callback(release)
+                works.append(work)
+                futures.append(asyncio.ensure_future(run(replication, work)))
+            results = await asyncio.gather(*futures)
+            await send({"id": job_id, "event": "done", "results": hospital_sim.average_results(results)})
+        except asyncio.CancelledError:
+            self.cancel_replications(futures, works)
+            raise
+        except Exception as error:
+            self.cancel_replications(futures, works)
+            await send({"id": job_id, "event": "error", "error": f"{type(error).__name__}: {error}"})
+
+    def cancel_replications(self, futures, works):
+        # Replications still queued on the pool are dropped, which frees their slots; those
+        # already running cannot be stopped and keep their slots until they finish
+        for work in works:
+            work.cancel()
+        for future in futures:
+            future.cancel()
+
+def submit(job, path=DEFAULT_SOCKET_PATH):
+   """
+   Sends a job to the service at path and yields the messages streamed back for it, up to
+   and including the final one ("done", "error", "cancelled" or "busy").
+   """
+   with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+      connection.connect(path)
+      connection.sendall(json.dumps(job).encode() + b"\n")
+      with connection.makefile("rb") as stream:
+         for line in stream:
+            message = json.loads(line)
+            yield message
+            if message["event"] in ("done", "error", "cancelled", "busy"):
+               return
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+   parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="path of the Unix socket to listen on")
+   parser.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+   parser.add_argument("--max-pending", type=int, help="replications queued on the workers at once "
+                                                       "(default: twice the number of workers)")
+   parser.add_argument("--max-jobs", type=int, default=64, help="jobs in progress before new ones are rejected")
+   parser.add_argument("--max-replications", type=int, default=1000, help="replications allowed in a single job")
+   parser.add_argument("--max-simulation-time", type=float, default=24 * 60 * 365,
+                       help="longest simulation time of a job, in minutes (default: one year)")
+   arguments = parser.parse_args()
+
+   service = SimulationService(arguments.workers, arguments.max_pending, arguments.max_jobs,
+                               arguments.max_replications, arguments.max_simulation_time)
+   try:
+      asyncio.run(service.serve(arguments.socket))
+   except KeyboardInterrupt:
+      pass
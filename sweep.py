@@ -0,0 +1,135 @@
+"""
+Staffing and bed capacity parameter sweeps for the emergency department simulation.
+
+A sweep runs every configuration of a grid for a number of replications, spread over a
+pool of worker processes. The results of every (configuration, replication) cell are
+stored in an on-disk cache keyed by the configuration, the seed, the replication, the
+simulation time and the version of the simulation code, so rerunning a sweep that overlaps
+a previous one only simulates the cells that are missing.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import itertools
+import json
+import os
+
+import numpy as np
+
+import hospital_sim
+
+def code_version():
+   """
+   Version of the simulation code, taken as a hash of the simulation module's source.
+   Cached results from a different version of the code are never reused.
+   """
+   with open(hospital_sim.__file__, "rb") as source:
+      return hashlib.sha256(source.read()).hexdigest()[:16]
+
+def configuration_grid(doctors=(2,), nurses=(2,), specialists=(5,),
+                       beds_per_zone=(hospital_sim.NUMBER_OF_BEDS_PER_ZONE,)):
+   """
+   Builds the list of configurations for every combination of the given numbers of
+   doctors, nurses and specialists and bed capacities (dicts of beds per zone).
+   """
+   return [{
+              "max_num_servers": {"doctors": d, "nurses": n, "specialists": s},
+              "number_of_beds_per_zone": dict(beds),
+           }
+           for d, n, s, beds in itertools.product(doctors, nurses, specialists, beds_per_zone)]
+
+def _normalize(value):
+   # JSON-compatible copy of a configuration: keys become strings (tuple keys of a
+   # procedure_mix are joined as "1,2") and tuples become lists
+   if isinstance(value, dict):
+      return {",".join(map(str, key)) if isinstance(key, tuple) else str(key): _normalize(item)
+              for key, item in value.items()}
+   if isinstance(value, (list, tuple)):
+      return [_normalize(item) for item in value]
+   return value
+
+class ResultCache():
+    """
+      On-disk store of the results of single replications, one JSON file per cell.
+    """
+    def __init__(self, directory="sweep_cache"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(configuration, seed_sequence, simulation_time, version):
+        """
+        Key of a cell. The replication is identified by its own SeedSequence (see
+        hospital_sim.replication_seeds), whose entropy and spawn key fix its random streams
+        whichever root seed, or however many earlier spawns, it came from.
+        """
+        stream = {"entropy": seed_sequence.entropy, "spawn_key": list(seed_sequence.spawn_key)}
+        cell = json.dumps([_normalize(configuration), stream, simulation_time, version], sort_keys=True)
+        return hashlib.sha256(cell.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, results):
+        # Write then rename, so an interrupted sweep never leaves a partial file behind
+        temporary_path = self._path(key) + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(results, file)
+        os.replace(temporary_path, self._path(key))
+
+def run_sweep(configurations, number_of_replications=10, simulation_time=24 * 60 * 180, seed=0,
+              cache=None, max_workers=None):
+   """
+   Runs every configuration for the given number of replications and returns, for each
+   configuration, its averaged results along with the results of every replication.
+
+   Replication i of every configuration uses the same random streams (common random
+   numbers), and only the cells missing from the cache are simulated. With a None seed,
+   the sweep draws fresh streams and bypasses the cache, as its cells can never be reused.
+   """
+   if seed is None:
+      seed, cache = np.random.SeedSequence(), None
+   else:
+      cache = cache if cache is not None else ResultCache()
+   version = code_version()
+   seed_sequences = hospital_sim.replication_seeds(number_of_replications, seed)
+
+   results = [[None] * number_of_replications for _ in configurations]
+   missing = []
+   for index, configuration in enumerate(configurations):
+      for replication in range(number_of_replications):
+         key = ResultCache.key(configuration, seed_sequences[replication], simulation_time, version) \
+               if cache is not None else None
+         results[index][replication] = cache.get(key) if cache is not None else None
+         if results[index][replication] is None:
+            missing.append((index, replication, key))
+
+   def store(index, replication, key, replication_results):
+      # Round trip through JSON so computed and cached results have the same types
+      replication_results = json.loads(json.dumps(replication_results, default=float))
+      if cache is not None:
+         cache.put(key, replication_results)
+      results[index][replication] = replication_results
+
+   if max_workers == 1:
+      for index, replication, key in missing:
+         store(index, replication, key, hospital_sim.run_replication(
+            simulation_time, seed_sequences[replication], configurations[index]))
+   elif missing:
+      with ProcessPoolExecutor(max_workers=max_workers) as executor:
+         futures = {executor.submit(hospital_sim.run_replication, simulation_time,
+                                    seed_sequences[replication], configurations[index]): (index, replication, key)
+                    for index, replication, key in missing}
+         for future in as_completed(futures):
+            store(*futures[future], future.result())
+
+   return [{"configuration": configuration,
+            "results": hospital_sim.average_results(results[index]),
+            "replications": results[index]}
+           for index, configuration in enumerate(configurations)]